@@ -0,0 +1,62 @@
+"""Benchmarks the Box2D simulator of the "box2d" physics provider (`box2d_physics.Box2DSimulator`) against the legacy `display_world.test_world_stability`.
+Builds random towers like `benchmark_physics.py`, determines the stability of every state with each setting and reports the mean latency per query and how often the results agree with the legacy check.
+"""
+
+import random
+import time
+
+import numpy as np
+
+from scoping_simulations.utils.blockworld import Blockworld
+from scoping_simulations.utils.box2d_physics import Box2DSimulator
+from scoping_simulations.utils.display_world import test_world_stability
+
+N = 200
+
+# collect random towers
+w = Blockworld(silhouette=np.ones((8, 8)), physics=False)
+states = []
+for i in range(N):
+    w.reset()
+    for j in range(5):
+        # take random action
+        actions = w.current_state.possible_actions()
+        try:
+            action = random.choice(actions)
+        except IndexError:
+            break
+        w.apply_action(action)
+        states.append(w.current_state)
+print("Collected", len(states), "towers")
+
+full_simulator = Box2DSimulator(early_exit=False)
+early_exit_simulator = Box2DSimulator()
+settings = {
+    "legacy": lambda state: test_world_stability(state.state_to_bwworld()) == "stable",
+    "full simulation": lambda state: full_simulator.get_stability(state.blocks),
+    "early exit": lambda state: early_exit_simulator.get_stability(state.blocks),
+}
+
+results = {}
+for label, get_stability in settings.items():
+    times = []
+    stabilities = []
+    for state in states:
+        start_time = time.time()
+        stabilities.append(get_stability(state))
+        times.append(time.time() - start_time)
+    results[label] = stabilities
+    print(f"mean time for Box2D ({label}):", np.mean(times) * 1000, "milliseconds")
+
+start_time = time.time()
+early_exit_simulator.get_stability_batch([state.blocks for state in states])
+print(
+    "mean time for Box2D (batch, early exit):",
+    (time.time() - start_time) / len(states) * 1000,
+    "milliseconds",
+)
+
+for label in ["full simulation", "early exit"]:
+    agreement = np.mean([a == b for a, b in zip(results["legacy"], results[label])])
+    print(f"Agreement of {label} with legacy: {agreement * 100:.2f}%")
+print(f"Stable towers (legacy): {np.mean(results['legacy']) * 100:.2f}%")
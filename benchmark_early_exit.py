@@ -0,0 +1,60 @@
+"""Benchmarks the early exit of the matter physics server against the legacy fixed-duration simulation.
+Builds random towers like `benchmark_physics.py`, determines the stability of every state with both settings and reports the mean latency per query and how often the two agree.
+"""
+
+import random
+import time
+
+import numpy as np
+
+import scoping_simulations.utils.matter_server as Matter_Server
+from scoping_simulations.utils.blockworld import Blockworld
+
+N = 100
+
+# collect random towers
+w = Blockworld(silhouette=np.ones((8, 8)), physics=False)
+towers = []
+for i in range(N):
+    w.reset()
+    for j in range(5):
+        # take random action
+        actions = w.current_state.possible_actions()
+        try:
+            action = random.choice(actions)
+        except IndexError:
+            break
+        w.apply_action(action)
+        towers.append(w.current_state.blocks)
+print("Collected", len(towers), "towers")
+
+results = {}
+for label, early_exit in [("fixed duration", False), ("early exit", True)]:
+    physics_provider = Matter_Server.Physics_Server(early_exit=early_exit)
+    # make sure the server is configured before timing
+    physics_provider.get_stability([])
+    times = []
+    stabilities = []
+    for blocks in towers:
+        start_time = time.time()
+        stabilities.append(physics_provider.get_stability(blocks))
+        times.append(time.time() - start_time)
+    results[label] = stabilities
+    print(
+        f"mean time for matter physics server ({label}):",
+        np.mean(times) * 1000,
+        "milliseconds",
+    )
+    for stable in [True, False]:
+        selected = [t for t, s in zip(times, stabilities) if s == stable]
+        if selected:
+            print(
+                f"    {'stable' if stable else 'unstable'} towers ({len(selected)}):",
+                np.mean(selected) * 1000,
+                "milliseconds",
+            )
+
+agreement = np.mean(
+    [a == b for a, b in zip(results["fixed duration"], results["early exit"])]
+)
+print(f"Agreement of early exit with fixed duration: {agreement * 100:.2f}%")
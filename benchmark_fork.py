@@ -0,0 +1,42 @@
+"""Benchmarks `Blockworld.fork` against `Blockworld.copy` (a deep copy of the world).
+Builds random towers like `benchmark_physics.py` and reports the mean time per copy of a world with each physics provider. The physics servers are never started, so node is not needed.
+"""
+
+import random
+import time
+
+import numpy as np
+
+from scoping_simulations.utils.blockworld import Blockworld
+
+N = 200
+
+for physics_provider in ["box2d", "matter"]:
+    # collect random towers
+    w = Blockworld(silhouette=np.ones((8, 8)), physics_provider=physics_provider)
+    worlds = []
+    for i in range(N):
+        w.reset()
+        for j in range(5):
+            # take random action
+            actions = w.current_state.possible_actions()
+            try:
+                action = random.choice(actions)
+            except IndexError:
+                break
+            w.apply_action(action)
+        worlds.append(w.fork())
+
+    for label, make_copy in [
+        ("copy", lambda world: world.copy()),
+        ("fork", lambda world: world.fork()),
+        ("fork with new silhouette", lambda world: world.fork(np.ones((8, 8)))),
+    ]:
+        start_time = time.perf_counter()
+        for world in worlds:
+            make_copy(world)
+        print(
+            f"mean time per {label} ({physics_provider}):",
+            (time.perf_counter() - start_time) / N * 1000,
+            "milliseconds",
+        )
@@ -0,0 +1,43 @@
+"""Benchmarks how long it takes to import the main modules in a fresh Python process.
+Every import is measured in its own interpreter, since modules are cached after the first import.
+Before the physics server was started lazily, importing blockworld blocked until node had started the server and loaded matter-js, so run this with a working node and matter-js to see that cost.
+"""
+
+import subprocess
+import sys
+
+import numpy as np
+
+N = 10
+
+MODULES = [
+    "scoping_simulations.utils.blockworld",
+    "scoping_simulations.experiments.experiment_runner",
+    "scoping_simulations.analysis.utils.analysis_helper",
+]
+
+MEASURE = """
+import time
+start_time = time.perf_counter()
+import {module}
+print(time.perf_counter() - start_time)
+"""
+
+for module in MODULES:
+    times = []
+    for i in range(N):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        # the import time is the last line of the output
+        times.append(float(output.strip().split("\n")[-1]))
+    print(
+        f"mean time to import {module}:",
+        np.mean(times) * 1000,
+        "milliseconds (min",
+        np.min(times) * 1000,
+        "milliseconds)",
+    )
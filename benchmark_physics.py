@@ -1,67 +1,261 @@
+"""Benchmark suite for the physics providers.
+
+Builds random towers for every combination of tower height and number of blocks and measures the latency of stability queries for each physics provider, first with cold caches (fresh memo and cache, server not yet started) and then again on the same towers with warm caches. Reports p50/p95/p99 latency and throughput as JSON.
+
+Providers:
+    box2d:   in-process Box2D simulator
+    matter:  a single matter physics server, one request per state
+    pool:    a PhysicsServerPool, states queried concurrently from several threads
+    batched: a single matter physics server, all states of a setting in one batched request
+    cached:  like matter, but with the stability memo and a fresh sqlite stability cache
+
+Usage:
+    python benchmark_physics.py --providers box2d matter --heights 8 12 --blocks 5 10 --output baseline.json
+    python benchmark_physics.py --baseline baseline.json
+
+With `--baseline`, every setting is compared to the saved results and the script exits with status 1 if any of them got slower by more than `--tolerance`.
+"""
+
+import argparse
+import json
+import os
 import random
+import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 import scoping_simulations.utils.matter_server as Matter_Server
+from scoping_simulations.utils import stability_cache
 from scoping_simulations.utils.blockworld import Blockworld
 
-N = 100
-
-print("Benchmarking Box2D")
-w = Blockworld(silhouette=np.ones((8, 8)), physics_provider="box2d")
-start_time = time.time()
-num_actions = 0
-times = []
-for i in range(N):
-    for j in range(5):
-        # take random action
-        actions = w.current_state.possible_actions()
-        try:
-            action = random.choice(actions)
-            num_actions += 1
-        except:
-            break
-        w.apply_action(action)
-        start_time = time.time()
-        stable = w.stability()
-        end_time = time.time()
-        # print("stability {},{} in {} milliseconds: {}".format(
-        # i, j, (end_time - start_time)*1000,stable))
-        times.append(end_time - start_time)
-    w.reset()
-# print("Box2D: %s seconds" % (time.time() - start_time)," #actions:",num_actions)
-print("mean time for Box2D physics server:", np.mean(times) * 1000, "milliseconds")
-
-# or to create a server
-physics_provider = Matter_Server.Physics_Server()
-
-print("Physics provider created")
-
-print("Benchmarking matter")
-w = Blockworld(silhouette=np.ones((8, 8)), physics_provider=physics_provider)
-start_time = time.time()
-num_actions = 0
-times = []
-for i in range(N):
-    # print(i)
-    for j in range(5):
-        # take random action
-        actions = w.current_state.possible_actions()
-        try:
-            action = random.choice(actions)
-            num_actions += 1
-        except:
-            break
-        w.apply_action(action)
-        start_time = time.time()
-        stable = w.stability()
-        end_time = time.time()
-        # print("stability {},{} in {} milliseconds: {}".format(
-        # i, j, (end_time - start_time)*1000,stable))
-        times.append(end_time - start_time)
-    w.reset()
-# print("matter: %s seconds" % (time.time() - start_time)," #actions:",num_actions)
-print("mean time for matter physics server:", np.mean(times) * 1000, "milliseconds")
-w.__del__()
-print("Done")
+PROVIDERS = ["box2d", "matter", "pool", "batched", "cached"]
+WORLD_WIDTH = 8
+
+
+def make_towers(height, n_blocks, n_towers, seed=0):
+    """Returns `n_towers` lists of blocks, each built by placing up to `n_blocks` random blocks in a world of the given height."""
+    random.seed(seed)
+    w = Blockworld(
+        dimension=(height, WORLD_WIDTH),
+        silhouette=np.ones((height, WORLD_WIDTH)),
+        legal_action_space=False,
+        physics=False,
+    )
+    towers = []
+    for i in range(n_towers):
+        w.reset()
+        for j in range(n_blocks):
+            # take random action
+            actions = w.current_state.possible_actions()
+            try:
+                action = random.choice(actions)
+            except IndexError:
+                break
+            w.apply_action(action)
+        towers.append(w.current_state.blocks)
+    return towers
+
+
+def make_world(provider, height, cache_path):
+    """Returns a Blockworld that answers stability queries with the given provider. Only the cached provider uses the memo and the stability cache, the analytic pre-filter is always off so that we measure the physics."""
+    if provider == "box2d":
+        physics_provider = "box2d"
+    elif provider == "pool":
+        physics_provider = Matter_Server.PhysicsServerPool(y_height=height)
+    else:
+        physics_provider = Matter_Server.Physics_Server(y_height=height)
+    cached = provider == "cached"
+    return Blockworld(
+        dimension=(height, WORLD_WIDTH),
+        silhouette=np.ones((height, WORLD_WIDTH)),
+        physics_provider=physics_provider,
+        stability_prefilter=False,
+        stability_memo=cached,
+        stability_cache=stability_cache.StabilityCache(cache_path) if cached else None,
+    )
+
+
+def time_queries(provider, world, towers):
+    """Queries the stability of every tower once. Returns the latency of each request in seconds and the total time."""
+    states = [Blockworld.State(world, blocks) for blocks in towers]
+    start_time = time.perf_counter()
+    if provider == "batched":
+        # a single request for all states
+        world.stability_batch(states)
+        latencies = [time.perf_counter() - start_time]
+    elif provider == "pool":
+
+        def timed_stability(state):
+            query_start_time = time.perf_counter()
+            state.stability()
+            return time.perf_counter() - query_start_time
+
+        with ThreadPoolExecutor(max_workers=world.physics_provider.n_workers) as pool:
+            latencies = list(pool.map(timed_stability, states))
+    else:
+        latencies = []
+        for state in states:
+            query_start_time = time.perf_counter()
+            state.stability()
+            latencies.append(time.perf_counter() - query_start_time)
+    return latencies, time.perf_counter() - start_time
+
+
+def summarize(latencies, total_time, n_states):
+    """Returns percentiles of the latencies in milliseconds and the throughput in states per second."""
+    latencies = np.array(latencies) * 1000
+    return {
+        "n_states": n_states,
+        "n_requests": len(latencies),
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_per_s": n_states / total_time,
+    }
+
+
+def run_benchmark(providers, heights, block_counts, n_towers, seed=0):
+    """Runs every provider on towers of every height and number of blocks with cold and then warm caches. Returns a list of result dictionaries."""
+    results = []
+    for height in heights:
+        for n_blocks in block_counts:
+            towers = make_towers(height, n_blocks, n_towers, seed)
+            mean_blocks = float(np.mean([len(blocks) for blocks in towers]))
+            for provider in providers:
+                cache_path = os.path.join(
+                    tempfile.mkdtemp(), "benchmark_stability_cache.sqlite"
+                )
+                stability_cache.stability_memo.clear()
+                world = make_world(provider, height, cache_path)
+                for caches in ["cold", "warm"]:
+                    latencies, total_time = time_queries(provider, world, towers)
+                    result = {
+                        "provider": provider,
+                        "height": height,
+                        "blocks": n_blocks,
+                        "mean_blocks": mean_blocks,
+                        "caches": caches,
+                    }
+                    result.update(summarize(latencies, total_time, len(towers)))
+                    results.append(result)
+                    print(
+                        f"{provider:>8} height {height:>2} blocks {n_blocks:>2} {caches}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, {result['throughput_per_s']:.0f} states/s",
+                        file=sys.stderr,
+                    )
+                if world.physics_provider != "box2d":
+                    world.physics_provider.kill_server()
+    return results
+
+
+def setting(result):
+    """Returns the parameters that identify a result across runs."""
+    return (
+        result["provider"],
+        result["height"],
+        result["blocks"],
+        result["caches"],
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Compares results to a baseline. Returns a list of regressions: settings where p50 or p95 latency grew or throughput dropped by more than `tolerance` (a fraction)."""
+    baseline_results = {setting(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old_result = baseline_results.get(setting(result))
+        if old_result is None:
+            continue
+        for measure in ["p50_ms", "p95_ms"]:
+            if result[measure] > old_result[measure] * (1 + tolerance):
+                regressions.append(
+                    {
+                        "setting": setting(result),
+                        "measure": measure,
+                        "baseline": old_result[measure],
+                        "current": result[measure],
+                    }
+                )
+        if result["throughput_per_s"] < old_result["throughput_per_s"] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                {
+                    "setting": setting(result),
+                    "measure": "throughput_per_s",
+                    "baseline": old_result["throughput_per_s"],
+                    "current": result["throughput_per_s"],
+                }
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the physics providers and report latency percentiles and throughput as JSON."
+    )
+    parser.add_argument(
+        "--providers",
+        nargs="+",
+        choices=PROVIDERS,
+        default=PROVIDERS,
+        help="physics providers to benchmark",
+    )
+    parser.add_argument(
+        "--heights", nargs="+", type=int, default=[8], help="heights of the world"
+    )
+    parser.add_argument(
+        "--blocks",
+        nargs="+",
+        type=int,
+        default=[5, 10],
+        help="number of blocks placed per tower",
+    )
+    parser.add_argument(
+        "--towers", type=int, default=100, help="number of towers per setting"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed for towers")
+    parser.add_argument(
+        "--output", type=str, default=None, help="file to write the JSON results to"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON results of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="fraction by which a measure may get worse before it counts as a regression",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.providers, args.heights, args.blocks, args.towers, args.seed
+    )
+    report = {"config": vars(args), "results": results}
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        report["regressions"] = compare(results, baseline, args.tolerance)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(
+                "Regression in {}: {} {:.2f} -> {:.2f}".format(
+                    regression["setting"],
+                    regression["measure"],
+                    regression["baseline"],
+                    regression["current"],
+                ),
+                file=sys.stderr,
+            )
+        sys.exit(1)
@@ -0,0 +1,71 @@
+"""Agreement report of the analytic stability pre-filter (`blockworld.analytic_stability`) against a physics provider.
+Builds random towers like `benchmark_physics.py` and compares the analytic classification of every state with the result of the physics provider: matter by default, or the one passed as the first argument ("box2d" or "matter").
+"""
+
+import random
+import sys
+import time
+
+import numpy as np
+
+from scoping_simulations.utils.blockworld import Blockworld, analytic_stability
+
+N = 1000
+PHYSICS_PROVIDER = sys.argv[1] if len(sys.argv) > 1 else "matter"
+
+# we query the physics provider directly, so the pre-filter of the world doesn't matter here
+w = Blockworld(
+    silhouette=np.ones((8, 8)),
+    physics_provider=PHYSICS_PROVIDER,
+    stability_prefilter=False,
+)
+if w.physics_provider == "box2d":
+    physics_provider = w.box2d_simulator
+else:
+    physics_provider = w.physics_provider
+
+counts = {
+    "stable": {True: 0, False: 0},
+    "unstable": {True: 0, False: 0},
+    "uncertain": {True: 0, False: 0},
+}
+analytic_times = []
+physics_times = []
+for i in range(N):
+    w.reset()
+    for j in range(5):
+        # take random action
+        actions = w.current_state.possible_actions()
+        try:
+            action = random.choice(actions)
+        except IndexError:
+            break
+        w.apply_action(action)
+        state = w.current_state
+        start_time = time.time()
+        analytic_result = analytic_stability(state.blockmap, state.blocks)
+        analytic_times.append(time.time() - start_time)
+        start_time = time.time()
+        stable = physics_provider.get_stability(state.blocks)
+        physics_times.append(time.time() - start_time)
+        counts[analytic_result][stable] += 1
+
+total = sum(sum(c.values()) for c in counts.values())
+decided = total - sum(counts["uncertain"].values())
+agreeing = counts["stable"][True] + counts["unstable"][False]
+print(f"Analytic result vs. {PHYSICS_PROVIDER} (stable / unstable):")
+for analytic_result, c in counts.items():
+    print(f"  {analytic_result:>9}: {c[True]:>6} / {c[False]:>6}")
+print(f"States checked: {total}")
+print(
+    f"Decided analytically (physics calls removed): {decided} ({decided / total * 100:.1f}%)"
+)
+print(
+    f"Agreement with {PHYSICS_PROVIDER} on decided states: {agreeing} of {decided} ({agreeing / max(decided, 1) * 100:.2f}%)"
+)
+print(
+    "mean time for analytic pre-filter:", np.mean(analytic_times) * 1000, "milliseconds"
+)
+print(
+    f"mean time for {PHYSICS_PROVIDER}:", np.mean(physics_times) * 1000, "milliseconds"
+)
@@ -0,0 +1,415 @@
+import copy
+import pickle
+import random
+import unittest
+
+import numpy as np
+
+from scoping_simulations.utils import blockworld
+from scoping_simulations.utils.blockworld import BaseBlock, Blockworld, legal
+
+
+def make_silhouette():
+    """Returns a silhouette with an overhang, so that towers can leave holes and blocks can stick out of it."""
+    silhouette = np.zeros((8, 8))
+    silhouette[3:, 1:7] = 1
+    silhouette[6:, 0] = 1
+    silhouette[5:, 3] = 0
+    return silhouette
+
+
+def random_states(world, n_walks=30, n_steps=10, seed=0):
+    """Returns the states along random walks through the world, placing blocks anywhere (not only inside the silhouette)."""
+    random.seed(seed)
+    states = []
+    for i in range(n_walks):
+        state = Blockworld.State(world, [])
+        for j in range(n_steps):
+            actions = state.possible_actions(legal=False)
+            if actions == []:
+                break
+            state = state.transition(random.choice(actions))
+            states.append(state)
+    return states
+
+
+class TestCompactState(unittest.TestCase):
+    def test_round_trip(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            compact_state = state.compact()
+            self.assertEqual(len(compact_state), len(state.blocks))
+            self.assertTrue((compact_state.blockmap == state.blockmap).all())
+            self.assertTrue((compact_state.bitmap == (state.blockmap > 0)).all())
+            self.assertEqual(compact_state.blocks, state.blocks)
+            expanded_state = compact_state.expand()
+            self.assertTrue((expanded_state.blockmap == state.blockmap).all())
+            self.assertEqual(expanded_state, state)
+
+    def test_is_free(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world, n_walks=5):
+            compact_state = state.compact()
+            for x in range(7):
+                for y in range(1, 8):
+                    self.assertEqual(
+                        compact_state.is_free(x, y, 2, 2),
+                        not (state.blockmap[y - 1 : y + 1, x : x + 2] > 0).any(),
+                    )
+
+    def test_order_invariant(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world, n_walks=10):
+            reordered_state = Blockworld.State(world, state.blocks[::-1])
+            self.assertEqual(state.compact(), reordered_state.compact())
+            self.assertEqual(hash(state.compact()), hash(reordered_state.compact()))
+
+    def test_stability(self):
+        # known stability is carried over, so compact states don't need the physics again
+        world = Blockworld(silhouette=make_silhouette(), physics_provider="box2d")
+        state = random_states(world, n_walks=1)[-1]
+        self.assertIsNone(state.compact()._stable)
+        state._stable = False
+        self.assertFalse(state.compact().stability())
+        self.assertFalse(state.compact().expand().stability())
+
+
+def count_holes(blockmap, silhouette):
+    """Counts the holes cell by cell: cells in the silhouette that aren't built, below a built cell in the silhouette."""
+    number_of_holes = 0
+    for x in range(blockmap.shape[1]):
+        covered = False
+        for y in range(blockmap.shape[0]):
+            if silhouette[y, x] > 0 and blockmap[y, x] > 0:
+                covered = True
+            elif covered and silhouette[y, x] > 0:
+                number_of_holes += 1
+    return number_of_holes
+
+
+class TestTransition(unittest.TestCase):
+    # transitions derive cached values from their parent, which should give the same values as building the state from its blocks
+
+    def test_blockmap(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            rebuilt_state = Blockworld.State(world, list(state.blocks))
+            self.assertTrue((state.blockmap == rebuilt_state.blockmap).all())
+            # the blockmap of the parent is left alone
+            parent = state.parent()
+            if parent is not None:
+                self.assertIsNot(state.blockmap, parent.blockmap)
+                self.assertEqual(
+                    np.sum(parent.blockmap > 0)
+                    + state.blocks[-1].width * state.blocks[-1].height,
+                    np.sum(state.blockmap > 0),
+                )
+
+    def test_skyline(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            rebuilt_state = Blockworld.State(world, list(state.blocks))
+            self.assertEqual(list(state.skyline), list(rebuilt_state.skyline))
+            # the topmost filled row of every column, the height of the world if it is empty
+            for x in range(8):
+                filled_rows = np.flatnonzero(state.blockmap[:, x] > 0)
+                self.assertEqual(
+                    state.skyline[x], filled_rows[0] if len(filled_rows) > 0 else 8
+                )
+
+    def test_possible_actions(self):
+        # actions generated from the skyline are exactly the placements that are in bounds
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world, n_walks=10):
+            expected_actions = []
+            for base_block in world.block_library:
+                for x in range(8 - base_block.width + 1):
+                    # the top rows that the block needs are free
+                    cells = state.blockmap[
+                        : base_block.height, x : x + base_block.width
+                    ]
+                    if not (cells > 0).any():
+                        expected_actions.append((base_block, x))
+            self.assertEqual(state.possible_actions(legal=False), expected_actions)
+
+    def test_legal_actions(self):
+        # the prefix sum over the silhouette should give the actions whose resulting state is legal
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            expected_actions = []
+            if legal(state):
+                expected_actions = [
+                    action
+                    for action in state.possible_actions(legal=False)
+                    if legal(world.transition(action, state))
+                ]
+            self.assertEqual(state.legal_actions(), expected_actions)
+
+    def test_legal_actions_silhouette(self):
+        # cached legal actions are recomputed for a new silhouette
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        state = world.current_state
+        actions = state.legal_actions()
+        world.set_silhouette(np.ones((8, 8)))
+        self.assertEqual(state.legal_actions(), state.possible_actions(legal=False))
+        self.assertNotEqual(state.legal_actions(), actions)
+
+    def test_holes(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        states = random_states(world)
+        self.assertGreater(max(state.holes() for state in states), 0)
+        for state in states:
+            self.assertEqual(
+                state.holes(), count_holes(state.blockmap, world.silhouette)
+            )
+            rebuilt_state = Blockworld.State(world, list(state.blocks))
+            self.assertEqual(state.holes(), rebuilt_state.holes())
+
+    def test_holes_silhouette(self):
+        # counts are redone for a new silhouette, also by the transitions of states counted for the old one
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        states = random_states(world, n_walks=10)
+        for state in states:
+            state.holes()
+        silhouette = np.ones((8, 8))
+        silhouette[:, 2] = 0
+        world.set_silhouette(silhouette)
+        for state in states:
+            self.assertEqual(state.holes(), count_holes(state.blockmap, silhouette))
+            for action in state.possible_actions(legal=False):
+                child = state.transition(action)
+                self.assertEqual(child.holes(), count_holes(child.blockmap, silhouette))
+
+
+class TestZobristHash(unittest.TestCase):
+    def test_incremental(self):
+        # the hash updated by transitions is the hash of the blocks in any order
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            blocks = list(state.blocks)
+            random.shuffle(blocks)
+            reordered_state = Blockworld.State(world, blocks)
+            self.assertEqual(state.zobrist_hash(), reordered_state.zobrist_hash())
+            self.assertEqual(hash(state), hash(reordered_state))
+            self.assertEqual(state, reordered_state)
+
+    def test_distinct(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        states = {}
+        for state in random_states(world):
+            states.setdefault(frozenset(state.block_codes()), state)
+        hashes = {state.zobrist_hash() for state in states.values()}
+        self.assertEqual(len(hashes), len(states))
+
+    def test_verify_state_equality(self):
+        # states with colliding hashes are only equal if their blocks aren't compared
+        for verify_state_equality in [True, False]:
+            world = Blockworld(
+                silhouette=make_silhouette(),
+                physics=False,
+                verify_state_equality=verify_state_equality,
+            )
+            states = random_states(world, n_walks=1)
+            state, other_state = states[0], states[-1]
+            self.assertNotEqual(state, other_state)
+            other_state._zobrist = state.zobrist_hash()
+            self.assertEqual(state == other_state, not verify_state_equality)
+
+
+class TestActionCodes(unittest.TestCase):
+    def test_round_trip(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        codes = set()
+        for base_block in world.block_library:
+            for x in range(8):
+                code = world.encode_action((base_block, x))
+                self.assertEqual(world.decode_action(code), (base_block, x))
+                codes.add(code)
+        # the codes index the action mask
+        self.assertEqual(codes, set(range(len(world.block_library) * 8)))
+        with self.assertRaises(ValueError):
+            world.encode_action((world.block_library[0], 8))
+
+    def test_copies(self):
+        # base blocks are interned, so actions of copies of a world are the same
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        self.assertIs(BaseBlock(2, 1), BaseBlock(2, 1))
+        for world_copy in [copy.deepcopy(world), pickle.loads(pickle.dumps(world))]:
+            self.assertEqual(world_copy.block_library, world.block_library)
+            for action in world.current_state.possible_actions(legal=False):
+                self.assertEqual(
+                    world_copy.encode_action(action), world.encode_action(action)
+                )
+            self.assertEqual(
+                world_copy.current_state.possible_actions(),
+                world.current_state.possible_actions(),
+            )
+
+    def test_action_mask(self):
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        for state in random_states(world):
+            for legal_actions in [True, False]:
+                mask = state.action_mask(legal=legal_actions)
+                actions = state.possible_actions(legal=legal_actions)
+                self.assertEqual(
+                    [world.decode_action(code) for code in np.flatnonzero(mask)],
+                    sorted(actions, key=world.encode_action),
+                )
+                for action in actions:
+                    self.assertTrue(world.is_possible_action(action, state))
+
+
+class TestScoreBatch(unittest.TestCase):
+    SCORING_FUNCTIONS = [
+        blockworld.F1score,
+        blockworld.precision,
+        blockworld.recall,
+        blockworld.filled_inside,
+        blockworld.filled_outside,
+        blockworld.holes,
+        blockworld.silhouette_score,
+        blockworld.silhouette_hole_score,
+        blockworld.F1_stability_score,
+        blockworld.silhouette_hole_stability_score,
+        blockworld.weighted_precision_recall,  # no batched kernel
+    ]
+
+    def make_world(self):
+        return Blockworld(
+            silhouette=make_silhouette(),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            legal_action_space=False,
+        )
+
+    def test_kernels(self):
+        world = self.make_world()
+        states = random_states(world)
+        blockmaps = blockworld.stack_blockmaps(states)
+        for batch_function, scoring_function in [
+            (blockworld.F1score_batch, blockworld.F1score),
+            (blockworld.precision_batch, blockworld.precision),
+            (blockworld.recall_batch, blockworld.recall),
+            (blockworld.filled_inside_batch, blockworld.filled_inside),
+            (blockworld.filled_outside_batch, blockworld.filled_outside),
+            (blockworld.holes_batch, blockworld.holes),
+        ]:
+            np.testing.assert_allclose(
+                batch_function(blockmaps, world.silhouette),
+                [scoring_function(state) for state in states],
+            )
+        np.testing.assert_allclose(
+            blockworld.silhouette_score_batch(
+                blockmaps, world.silhouette, world.fail_penalty
+            ),
+            [blockworld.silhouette_score(state) for state in states],
+        )
+
+    def test_score_batch(self):
+        # batched scores of fresh states should equal the scalar scores of other fresh states
+        for scoring_function in self.SCORING_FUNCTIONS:
+            states = random_states(self.make_world())
+            other_states = random_states(self.make_world())
+            np.testing.assert_allclose(
+                blockworld.score_batch(states, scoring_function),
+                [scoring_function(state) for state in other_states],
+                err_msg=scoring_function.__name__,
+            )
+        self.assertEqual(len(blockworld.score_batch([], blockworld.F1score)), 0)
+
+    def test_world_score_batch(self):
+        # including the fail penalty and the win reward
+        world = self.make_world()
+        states = random_states(world)
+        other_world = self.make_world()
+        other_states = random_states(other_world)
+        for scoring_function in [blockworld.F1score, blockworld.silhouette_score]:
+            self.assertEqual(
+                world.score_batch(states, scoring_function),
+                [other_world.score(state, scoring_function) for state in other_states],
+            )
+
+
+class TestFork(unittest.TestCase):
+    def test_isolation(self):
+        # changes to the fork don't reach the world
+        world = Blockworld(silhouette=make_silhouette(), physics_provider="box2d")
+        for action in [(world.block_library[0], 1), (world.block_library[2], 4)]:
+            world.apply_action(action)
+        blocks = list(world.current_state.blocks)
+        blockmap = world.current_state.blockmap.copy()
+        fork = world.fork()
+        self.assertIs(fork.block_library, world.block_library)
+        self.assertIs(fork.box2d_simulator, world.box2d_simulator)
+        self.assertEqual(fork.current_state, world.current_state)
+        fork.apply_action(fork.current_state.possible_actions()[0])
+        fork.current_state.blocks.append(fork.current_state.blocks[0])
+        fork.current_state.blockmap[:] = 0
+        self.assertEqual(world.current_state.blocks, blocks)
+        self.assertTrue((world.current_state.blockmap == blockmap).all())
+        self.assertEqual(len(fork.current_state.blocks), 4)
+
+    def test_silhouette(self):
+        # a fork with a different silhouette scores against it, without changing the world's scores
+        world = Blockworld(silhouette=make_silhouette(), physics=False)
+        world.apply_action((world.block_library[0], 1))
+        F1 = world.F1score()
+        silhouette = np.ones((8, 8))
+        fork = world.fork(silhouette)
+        self.assertIs(fork.silhouette, silhouette)
+        self.assertIs(fork.full_silhouette, world.full_silhouette)
+        self.assertAlmostEqual(
+            fork.F1score(), blockworld.F1score(fork.current_state, force=True)
+        )
+        self.assertNotAlmostEqual(fork.F1score(), F1)
+        self.assertEqual(world.F1score(), F1)
+        self.assertIsNot(world.silhouette, silhouette)
+
+
+class TestTerminalChecks(unittest.TestCase):
+    def make_world(self):
+        silhouette = np.zeros((8, 8))
+        silhouette[7, 0:2] = 1
+        world = Blockworld(silhouette=silhouette, physics_provider="box2d")
+        world.apply_action((BaseBlock(2, 1), 0))
+        return world
+
+    def test_memo(self):
+        world = self.make_world()
+        self.assertEqual(world.status(), ("Win", "None"))
+        checks = world.current_state.terminal_checks()
+        self.assertEqual(checks["status"], ("Win", "None"))
+        self.assertTrue(checks["win"])
+        self.assertIs(world.current_state.terminal_checks(), checks)
+
+    def test_silhouette(self):
+        # the checks are redone for a new silhouette
+        world = self.make_world()
+        self.assertEqual(world.status(), ("Win", "None"))
+        self.assertTrue(world.is_full_win())
+        silhouette = np.zeros((8, 8))
+        silhouette[6:, 0:2] = 1
+        world.set_silhouette(silhouette)
+        self.assertEqual(world.status(), ("Ongoing", "None"))
+        self.assertFalse(world.is_win())
+        # the full silhouette is kept
+        self.assertTrue(world.is_full_win())
+        world.set_silhouette(silhouette, is_full=True)
+        self.assertFalse(world.is_full_win())
+
+    def test_blocks(self):
+        # and when the blocks of the state change
+        world = self.make_world()
+        state = world.current_state
+        self.assertTrue(world.is_win())
+        state.blocks.append(world.transition((BaseBlock(2, 1), 0)).blocks[-1])
+        state._update_map_with_blocks(state.blocks[-1:])
+        self.assertEqual(state.terminal_checks(), {})
+        world.status()
+        state.clear()
+        self.assertEqual(state.terminal_checks(), {})
+        self.assertFalse(world.is_win())
+
+
+if __name__ == "__main__":
+    unittest.main()
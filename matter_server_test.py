@@ -1,5 +1,13 @@
+import asyncio
+import os
+import pickle
+import random
+import struct
+import tempfile
 import unittest
+from unittest import mock
 
+from scoping_simulations.utils import matter_server as ms
 from scoping_simulations.utils.blockworld import Blockworld
 from scoping_simulations.utils.blockworld_library import (
     bl_nonoverlapping_simple,
@@ -9,6 +17,24 @@ from scoping_simulations.utils.blockworld_library import (
 blsn = bl_nonoverlapping_simple_named
 
 
+def towers_13_47():
+    """Returns the lists of blocks of the states along the 13_47 tower, which has stable and unstable states."""
+    world = Blockworld(block_library=bl_nonoverlapping_simple)
+    actions = [
+        (blsn["h3"], 1),
+        (blsn["v2"], 1),
+        (blsn["h2"], 2),
+        (blsn["h2"], 3),
+        (blsn["v3"], 4),
+        (blsn["h3"], 1),
+    ]
+    list_of_blocks = []
+    for action in actions:
+        world.apply_action(action)
+        list_of_blocks.append(world.current_state.blocks)
+    return list_of_blocks
+
+
 class TestMatterServer(unittest.TestCase):
     # def test_empty(self):
     #     server = ms.Physics_Server()
@@ -83,6 +109,204 @@ class TestMatterServer(unittest.TestCase):
         print(stables)
         self.assertTrue(False in stables)
 
+    def test_batch(self):
+        # batched requests should agree with requesting the stability of each state individually
+        world = Blockworld(block_library=bl_nonoverlapping_simple)
+        actions = [
+            (blsn["h3"], 1),
+            (blsn["v2"], 1),
+            (blsn["h2"], 2),
+            (blsn["h2"], 3),
+            (blsn["v3"], 4),
+            (blsn["h3"], 1),
+        ]
+        states = []
+        for action in actions:
+            world.apply_action(action)
+            states.append(world.current_state)
+        list_of_blocks = [state.blocks for state in states]
+        server = world.physics_provider
+        self.assertEqual(
+            server.get_stability_batch(list_of_blocks),
+            [server.get_stability(blocks) for blocks in list_of_blocks],
+        )
+        self.assertEqual(server.get_stability_batch([]), [])
+
+    def test_pool(self):
+        # a pool should agree with a single server, also when the batch is split across workers
+        list_of_blocks = towers_13_47()
+        server = ms.Physics_Server()
+        expected = [server.get_stability(blocks) for blocks in list_of_blocks]
+        pool = ms.PhysicsServerPool(n_workers=3)
+        try:
+            self.assertEqual(pool.get_stability_batch(list_of_blocks), expected)
+            self.assertEqual(
+                [pool.get_stability(blocks) for blocks in list_of_blocks], expected
+            )
+            stats = pool.stats()
+            self.assertEqual(stats["requests"], 3 + len(list_of_blocks))
+            self.assertEqual(stats["queue_depth"], 0)
+            self.assertEqual(stats["in_flight"], 0)
+            self.assertEqual(stats["restarts"], 0)
+            # crashed workers are restarted and the request is sent again
+            for worker in pool._workers:
+                worker.kill()
+                worker.wait()
+            self.assertEqual(pool.get_stability(list_of_blocks[-1]), expected[-1])
+            self.assertEqual(pool.stats()["restarts"], 1)
+        finally:
+            pool.kill_server()
+
+    def test_pool_pickle(self):
+        # unpickled pools start their own workers with the same parameters
+        pool = ms.PhysicsServerPool(n_workers=2, early_exit=True, min_frames=30)
+        unpickled_pool = pickle.loads(pickle.dumps(pool))
+        self.assertIsInstance(unpickled_pool, ms.PhysicsServerPool)
+        self.assertEqual(unpickled_pool.n_workers, 2)
+        self.assertEqual(unpickled_pool.simulation_config(), pool.simulation_config())
+        self.assertEqual(unpickled_pool._workers, [])
+
+    def test_pack_stability_request(self):
+        # the frame layout is documented at the top of matter_server.py
+        blocks = towers_13_47()[1]
+        static_blocks = towers_13_47()[0][:1]
+        frame = ms.pack_stability_request(7, [blocks, []], [static_blocks, []])
+        (length,) = struct.unpack_from("<I", frame, 0)
+        self.assertEqual(length, len(frame) - 4)
+        self.assertEqual(
+            struct.unpack_from("<BIH", frame, 4), (ms.MESSAGE_STABILITY, 7, 2)
+        )
+        offset = 4 + 7
+        (n_blocks,) = struct.unpack_from("<H", frame, offset)
+        self.assertEqual(n_blocks, len(blocks) + len(static_blocks))
+        offset += 2
+        for block, static in [(b, 0) for b in blocks] + [(b, 1) for b in static_blocks]:
+            self.assertEqual(
+                struct.unpack_from("<4fB", frame, offset),
+                (block.x, 8 - 1 - block.y, block.width, block.height, static),
+            )
+            offset += struct.calcsize("<4fB")
+        self.assertEqual(struct.unpack_from("<H", frame, offset), (0,))
+        self.assertEqual(offset + 2, len(frame))
+
+    def test_binary_protocol(self):
+        # both protocols should give the same results
+        list_of_blocks = towers_13_47()
+        text_server = ms.Physics_Server(protocol="text")
+        binary_server = ms.Physics_Server(protocol="binary")
+        expected = [text_server.get_stability(blocks) for blocks in list_of_blocks]
+        self.assertEqual(
+            [binary_server.get_stability(blocks) for blocks in list_of_blocks],
+            expected,
+        )
+        self.assertEqual(binary_server.get_stability_batch(list_of_blocks), expected)
+        # with the first block of every tower fixed in place
+        dynamic_blocks = [blocks[1:] for blocks in list_of_blocks]
+        static_blocks = [blocks[:1] for blocks in list_of_blocks]
+        self.assertEqual(
+            binary_server.get_stability_batch(dynamic_blocks, static_blocks),
+            text_server.get_stability_batch(dynamic_blocks, static_blocks),
+        )
+        # the servers share the global process, which switches protocol as needed
+        self.assertEqual(text_server.get_stability_batch(list_of_blocks), expected)
+
+    def test_protocol_value(self):
+        with self.assertRaises(ValueError):
+            ms.Physics_Server(protocol="xml")
+
+    def test_async(self):
+        # concurrent requests on the pipelined server should agree with the synchronous server
+        list_of_blocks = towers_13_47()
+        server = ms.Physics_Server()
+        expected = [server.get_stability(blocks) for blocks in list_of_blocks]
+
+        async def run():
+            async with ms.AsyncPhysicsServer(n_workers=2) as async_server:
+                stabilities = await asyncio.gather(
+                    *[async_server.get_stability(blocks) for blocks in list_of_blocks]
+                )
+                self.assertEqual(list(stabilities), expected)
+                self.assertEqual(
+                    await async_server.get_stability_batch(list_of_blocks), expected
+                )
+                self.assertEqual(await async_server.get_stability_batch([]), [])
+                self.assertEqual(async_server.outstanding_requests(), 0)
+                # dead workers are restarted and their requests sent again
+                async_server._workers[0].process.kill()
+                await async_server._workers[0].process.wait()
+                stabilities = await asyncio.gather(
+                    *[async_server.get_stability(blocks) for blocks in list_of_blocks]
+                )
+                self.assertEqual(list(stabilities), expected)
+                self.assertEqual(async_server.outstanding_requests(), 0)
+
+        asyncio.run(run())
+
+    def test_incremental(self):
+        # simulating only the support cone of the new block should agree with simulating the full tower
+        world = Blockworld(
+            block_library=bl_nonoverlapping_simple,
+            incremental_stability=True,
+            legal_action_space=False,
+        )
+        reference = Blockworld(
+            block_library=bl_nonoverlapping_simple,
+            stability_prefilter=False,
+            stability_memo=False,
+        )
+        random.seed(0)
+        for i in range(10):
+            world.reset()
+            for j in range(6):
+                state = world.current_state
+                if not state.stability():
+                    break
+                children = [state.transition(a) for a in state.possible_actions()]
+                self.assertEqual(
+                    world.stability_batch(children),
+                    [
+                        Blockworld.State(reference, child.blocks).stability()
+                        for child in children
+                    ],
+                )
+                world.apply_action(random.choice(state.possible_actions()))
+
+    def run_with_server_script(self, script, protocol="text"):
+        """Sends a request to a server running the given node script instead of the physics server. Returns the number of processes launched and the error raised."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "server.js")
+            with open(path, "w") as f:
+                f.write(script)
+            server = ms.Physics_Server(protocol=protocol)
+            # with a process of its own, not the one shared with the other tests
+            with mock.patch.object(ms, "js_location", path), mock.patch.object(
+                ms, "process", None
+            ), mock.patch.object(
+                ms, "launch_process", wraps=ms.launch_process
+            ) as launch_process:
+                with self.assertRaises(ValueError) as context:
+                    server.get_stability([])
+            server.kill_server()
+            return launch_process.call_count, str(context.exception)
+
+    def test_server_does_not_start(self):
+        # a server that can't start (eg. without matter-js) is not started again
+        n_launches, error = self.run_with_server_script(
+            "console.error('no matter here'); process.exit(1);"
+        )
+        self.assertEqual(n_launches, 1)
+        self.assertIn("no matter here", error)
+
+    def test_server_dies(self):
+        # a server that dies on every request is restarted a limited number of times
+        for protocol in ["text", "binary"]:
+            n_launches, error = self.run_with_server_script(
+                "console.log('ready'); process.stdin.on('data', () => process.exit(1));",
+                protocol,
+            )
+            self.assertEqual(n_launches, ms.Physics_Server.MAX_RETRIES + 1)
+            self.assertIn("died", error)
+
 
 if __name__ == "__main__":
     unittest.main()
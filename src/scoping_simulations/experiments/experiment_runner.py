@@ -13,6 +13,7 @@ import tqdm
 
 from scoping_simulations.analysis.utils.analysis_helper import preprocess_df
 from scoping_simulations.utils.directories import PROJ_DIR
+from scoping_simulations.utils.stability_cache import stability_memo
 
 RESULTS_DIR = os.path.join(PROJ_DIR, "results")
 DF_DIR = os.path.join(RESULTS_DIR, "dataframes")
@@ -45,6 +46,8 @@ various agent parameters (depends on agent loaded)
 'execution_time': computation time of the planning step in seconds
 'world_status': either fail, ongoing, winning
 'world_failure_reason': if world_status is fail, then the reason is given here
+'stability_memo_hits': number of stability checks during the planning step that were answered from the in-memory stability memo instead of the physics engine
+'stability_memo_translated_hits': the part of 'stability_memo_hits' where the tower had been simulated at another horizontal offset, ie. the physics calls saved by translation invariance
 'agent_attributes': the attributes of the agent as dictionary. Allow for easy grouping of agents across runs. Does not include random seed.
 **agent attributes unrolled** as provided by the class of agent. Includes random_seed.
 """
@@ -70,6 +73,8 @@ DF_COLS = [
     "execution_time",
     "world_status",
     "world_failure_reason",
+    "stability_memo_hits",
+    "stability_memo_translated_hits",
     "agent_attributes",
 ]
 RAM_LIMIT = 100  # percentage of RAM usage over which a process doesn't run as to not run out of memory
@@ -97,7 +102,7 @@ def run_experiment(
     # we need to copy the world and agent to reset them
     # create a list of experiments to run
     experiments = [
-        (copy.deepcopy(w), copy.deepcopy(a), steps, verbose, i)
+        ((w[0], w[1].fork()), copy.deepcopy(a), steps, verbose, i)
         for i in range(per_exp)
         for a in agents
         for w in worlds.items()
@@ -121,6 +126,14 @@ def run_experiment(
 
     preprocess_df(results)  # automatically fill in code relevant to analysis
 
+    print(
+        "Stability memo saved",
+        int(results["stability_memo_hits"].sum()),
+        "physics calls,",
+        int(results["stability_memo_translated_hits"].sum()),
+        "of them through translation invariance",
+    )
+
     if save is not False:
         # check if results directory exists
         if not os.path.isdir(DF_DIR):
@@ -216,6 +229,8 @@ def _run_single_experiment(experiment):
     while i != steps and planning_step != steps and world.status()[0] == "Ongoing":
         # execute the action
         try:
+            memo_hits = stability_memo.hits
+            memo_translated_hits = stability_memo.translated_hits
             start_time = time.perf_counter()
             chosen_actions, agent_step_info = agent.act(verbose=verbose)
             duration = time.perf_counter() - start_time
@@ -266,6 +281,10 @@ def _run_single_experiment(experiment):
             )
             i += 1  # for the following code. NOTE better check whether that truly makes sense
         r.at[i - 1, "execution_time"] = duration
+        r.at[i - 1, "stability_memo_hits"] = stability_memo.hits - memo_hits
+        r.at[i - 1, "stability_memo_translated_hits"] = (
+            stability_memo.translated_hits - memo_translated_hits
+        )
         world_status = world.status()
         r.at[i - 1, "world_status"] = world_status[0]
         r.at[i - 1, "world_failure_reason"] = world_status[1]
@@ -22,6 +22,8 @@ class Astar_Agent(BFS_Agent):
 
     The heuristic should be admissible: it should be an upper bound to the actual cost of reaching the goal.
     The h function estimates distance to goal by taking a heuristic, which should return degree of completion between 0 and 1, calculated the number of cells left to fill out and takes the average size of blocks in the library to provice an estimation of steps left to goal. Penalties get represented as really large distances.
+
+    With `compact_frontier`, the states in the open set are stored as `Blockworld.CompactState`, which takes a fraction of the memory and allows for deeper searches.
     """
 
     def __init__(
@@ -31,12 +33,14 @@ class Astar_Agent(BFS_Agent):
         only_improving_actions=False,
         random_seed=None,
         label="A*",
+        compact_frontier=False,
     ):
         self.world = world
         self.heuristic = heuristic
         self.only_improving_actions = only_improving_actions
         self.random_seed = random_seed
         self.label = label
+        self.compact_frontier = compact_frontier
         if self.random_seed is None:
             self.random_seed = random.randint(0, 99999)
 
@@ -59,6 +63,7 @@ class Astar_Agent(BFS_Agent):
             "heuristic": self.heuristic.__name__,
             "random_seed": self.random_seed,
             "label": self.label,
+            "compact_frontier": getattr(self, "compact_frontier", False),
         }
 
     def act(self, steps=None, verbose=False):
@@ -100,6 +105,7 @@ class Astar_Agent(BFS_Agent):
         states_evaluated = 0  # track number of states evaluated
         # initialize open set
         open_set = open_set = Stochastic_Priority_Queue(random_seed=self.random_seed)
+        compact_frontier = getattr(self, "compact_frontier", False)
         # put in root node
         open_set.put(FringeNode(self.f(root), Node(root, [])))
         while not open_set.empty():
@@ -110,6 +116,8 @@ class Astar_Agent(BFS_Agent):
             if node is None:
                 # empty means that the open set is empty
                 break
+            if type(node.state) is blockworld.Blockworld.CompactState:
+                node.state = node.state.expand()
             # check if that node is winning
             states_evaluated += 1
             # check for stability
@@ -124,9 +132,10 @@ class Astar_Agent(BFS_Agent):
             actions = node.state.possible_actions()  # get possible actions
             for action in actions:
                 child = node.state.transition(action)
-                open_set.put(
-                    FringeNode(self.f(child), Node(child, node.actions + [action]))
-                )
+                cost = self.f(child)
+                if compact_frontier:
+                    child = child.compact()
+                open_set.put(FringeNode(cost, Node(child, node.actions + [action])))
             # if verbose: print("added",len(actions),"new states at",i) #DEBUG
             if verbose and i % 1000 == 0:
                 print(
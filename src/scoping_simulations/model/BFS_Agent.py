@@ -1,17 +1,28 @@
 import random
 
+import scoping_simulations.utils.blockworld as blockworld
 from scoping_simulations.model.Agent import Agent
 from scoping_simulations.model.utils.Search_Tree import *
 
 
 class BFS_Agent(Agent):
-    """An agent performing exhaustive BFS search. This can take a long time to finish."""
+    """An agent performing exhaustive BFS search. This can take a long time to finish.
+    With `compact_frontier`, the states waiting to be expanded are stored as `Blockworld.CompactState`, which takes a fraction of the memory and allows for deeper searches.
+    """
 
-    def __init__(self, world=None, shuffle=False, random_seed=None, label="BFS"):
+    def __init__(
+        self,
+        world=None,
+        shuffle=False,
+        random_seed=None,
+        label="BFS",
+        compact_frontier=False,
+    ):
         self.world = world
         self.shuffle = shuffle
         self.random_seed = random_seed
         self.label = label
+        self.compact_frontier = compact_frontier
 
     def __str__(self):
         """Yields a string representation of the agent"""
@@ -32,6 +43,7 @@ class BFS_Agent(Agent):
             "shuffle": self.shuffle,
             "random_seed": self.random_seed,
             "label": self.label,
+            "compact_frontier": getattr(self, "compact_frontier", False),
         }
 
     def search(self, current_nodes):
@@ -41,12 +53,19 @@ class BFS_Agent(Agent):
             random.seed(self.random_seed)  # fix random seed
             random.shuffle(current_nodes)
         next_nodes = []  # holds the nodes we get from the current expansion step
+        compact_frontier = getattr(self, "compact_frontier", False)
         for node in current_nodes:  # expand current nodes
-            possible_actions = node.state.possible_actions()
-            for action in possible_actions:
-                child = Node(
-                    node.state.transition(action), node.actions + [action]
-                )  # generate new node
+            state = node.state
+            if type(state) is blockworld.Blockworld.CompactState:
+                state = state.expand()
+            possible_actions = state.possible_actions()
+            children = [
+                Node(state.transition(action), node.actions + [action])
+                for action in possible_actions
+            ]  # generate new nodes
+            # determine the stability of all children in one request to the physics server
+            self.world.stability_batch([child.state for child in children])
+            for child in children:
                 # check if child node is winning
                 cost += 1
                 # check stability
@@ -55,6 +74,8 @@ class BFS_Agent(Agent):
                 if child.state.is_win():
                     # we've found a winning state
                     return "Winning", child, cost
+                if compact_frontier:
+                    child.state = child.state.compact()
                 next_nodes.append(child)
         return "Ongoing", next_nodes, cost
 
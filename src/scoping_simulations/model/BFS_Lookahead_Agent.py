@@ -76,18 +76,19 @@ class BFS_Lookahead_Agent(Agent):
 
         def fill_node(node):
             possible_actions = node.state.possible_actions()
-            for action in possible_actions:
+            targets = [
+                self.world.transition(action, node.state) for action in possible_actions
+            ]
+            if self.dense_stability:
+                # determine the stability of all children in one request to the physics server
+                self.world.stability_batch(targets)
+            for action, target in zip(possible_actions, targets):
                 # add action to current node with target state already filled out
                 # check for stability
-                if (
-                    self.dense_stability
-                    and not self.world.transition(action, node.state).stability()
-                ):
+                if self.dense_stability and not target.stability():
                     continue
                 # add the result of applying the action
-                node.add_action(
-                    action, Ast_node(self.world.transition(action, node.state))
-                )
+                node.add_action(action, Ast_node(target))
 
         if horizon is None:
             horizon = self.horizon
@@ -103,11 +104,12 @@ class BFS_Lookahead_Agent(Agent):
             for node in current_nodes:
                 fill_node(node)  # add children etc
                 # score the child nodes
-                for action in node.actions:
-                    self.score_node(
-                        action.target, self.sparse, self.dense_stability
-                    )  # score the node
-                    number_of_states_evaluated += 1
+                self.score_nodes(
+                    [action.target for action in node.actions],
+                    self.sparse,
+                    self.dense_stability,
+                )
+                number_of_states_evaluated += len(node.actions)
                 if self.first_solution and self.world.is_win(node.state):
                     # we have found a winning node, so we return the sequence of action to get there
                     if verbose:
@@ -141,6 +143,22 @@ class BFS_Lookahead_Agent(Agent):
             # dense rewards
             node.score = self.world.score(node.state, self.scoring_function)
 
+    def score_nodes(self, nodes, sparse=False, dense_stability=True):
+        """Scores a list of nodes like `score_node`. Dense rewards of all nodes are computed in one batch (see `Blockworld.score_batch`)."""
+        if sparse:
+            for node in nodes:
+                self.score_node(node, sparse, dense_stability)
+            return
+        states = [node.state for node in nodes]
+        if dense_stability:
+            stabilities = self.world.stability_batch(states)
+        else:
+            stabilities = [None] * len(nodes)
+        scores = self.world.score_batch(states, self.scoring_function)
+        for node, stability, score in zip(nodes, stabilities, scores):
+            node.stability = stability
+            node.score = score
+
     def score_ast(self, root, horizon="All", sparse=None, dense_stability=None):
         """Iterate through the Ast and score all the nodes in it. Works in place. Can use sparse rewards or dense. We can also choose to not score stability—in that case stability is scored implicitly by the world.score function that returns the preset world reward for win states. Dense stability scores the node at the end of planning. Dense reward only gives reward if the world is in a terminal state."""
         if sparse is None:
@@ -156,9 +174,9 @@ class BFS_Lookahead_Agent(Agent):
         current_nodes = [root]
         while current_nodes != [] and counter != 0:
             children_nodes = []
+            self.score_nodes(current_nodes, sparse, dense_stability)
+            number_of_states_evaluated += len(current_nodes)
             for node in current_nodes:
-                self.score_node(node, sparse, dense_stability)
-                number_of_states_evaluated += 1
                 children_nodes += [action.target for action in node.actions]
             current_nodes = children_nodes
             counter = counter - 1
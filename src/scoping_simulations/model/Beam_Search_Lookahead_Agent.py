@@ -110,10 +110,16 @@ class Beam_Search_Lookahead_Agent(BFS_Lookahead_Agent):
             for node in current_nodes:
                 # add possible edges to the next set of candidate edges
                 possible_actions = node.state.possible_actions()
-                for action in possible_actions:
-                    # get target state ast node object
+                # get target state ast node objects
+                targets = [
+                    Ast_node(self.world.transition(action, node.state))
+                    for action in possible_actions
+                ]
+                if self.dense_stability:
+                    # determine the stability of all targets in one request to the physics server
+                    self.world.stability_batch([target.state for target in targets])
+                for action, target in zip(possible_actions, targets):
                     number_of_states_evaluated += 1
-                    target = Ast_node(self.world.transition(action, node.state))
                     edge = Ast_edge(action, node, target)  # make edge
                     # check for stability
                     if self.dense_stability and not target.state.stability():
@@ -148,8 +154,14 @@ class Beam_Search_Lookahead_Agent(BFS_Lookahead_Agent):
             def get_score_node(node):
                 return self.heuristic(node.state)
 
-            # sort the list according to the heuristic
-            candidate_edges.sort(key=get_score_edge, reverse=True)
+            # sort the list according to the heuristic, scoring all candidates in one batch
+            scores = blockworld.score_batch(
+                [edge.target.state for edge in candidate_edges], self.heuristic
+            )
+            order = sorted(
+                range(len(candidate_edges)), key=lambda i: scores[i], reverse=True
+            )
+            candidate_edges = [candidate_edges[i] for i in order]
             if verbose:
                 print(
                     "Best 6 actions:",
@@ -389,8 +389,7 @@ class Construction_Paper_Agent(BFS_Lookahead_Agent):
         if verbose:
             print("Got decomposition\n ", new_silhouette)
         # create temporary world object containing the modified silhouette
-        temp_world = copy.deepcopy(self.world)
-        temp_world.silhouette = new_silhouette
+        temp_world = self.world.fork(silhouette=new_silhouette)
         self.lower_agent.set_world(temp_world)
         # let's run the lower level agent
         action_seq = []
@@ -411,9 +410,7 @@ class Construction_Paper_Agent(BFS_Lookahead_Agent):
                 temp_world.status()[0],
             )
         for action in action_seq:
-            self.world.apply_action(
-                action, force=True
-            )  # we need force here since the baseblock objects are in different memory locations
+            self.world.apply_action(action)
         # we need to carry over the decomposition status to the actual world
         try:
             self.world.current_state._construction_paper_loc = (
@@ -90,10 +90,8 @@ class Lax_Resource_Rational_Subgoal_Planning_Agent(
         if prior_world is None:
             prior_world = self.world
         # generate key for cache
-        key = decomposition * 100 - (
-            prior_world.current_state.order_invariant_blockmap() > 0
-        )
-        key = key.tostring()  # make hashable
+        key = decomposition * 100 - (prior_world.current_state.blockmap > 0)
+        key = key.tobytes()  # make hashable
         if key in self._cached_subgoal_evaluations:
             # print("Cache hit for",key)
             cached_eval = self._cached_subgoal_evaluations[key]
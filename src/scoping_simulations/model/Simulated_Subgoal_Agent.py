@@ -152,9 +152,7 @@ class Simulated_Subgoal_Agent(Subgoal_Planning_Agent):
                 # print("No actions could be found for subgoal "+str(sg.name))
                 continue
             for action in sg.actions:
-                self.world.apply_action(
-                    action, force=True
-                )  # applying the actions to the world — we need force here because the reference of the baseblock objects aren't the same
+                self.world.apply_action(action)  # applying the actions to the world
                 actions.append(action)
             names.append(sg.name)
             cur_i += 1
@@ -140,8 +140,7 @@ class Subgoal_Planning_Agent(BFS_Lookahead_Agent):
                 print("No actions could be found for subgoal " + str(sg.name))
                 continue
             for action in sg.actions:
-                # applying the actions to the world — we need force here because the reference of the baseblock objects aren't the same
-                self.world.apply_action(action, force=True)
+                self.world.apply_action(action)  # applying the actions to the world
                 actions.append(action)
             solution_cost += sg.solution_cost
             partial_planning_cost += sg.planning_cost
@@ -267,7 +266,7 @@ class Subgoal_Planning_Agent(BFS_Lookahead_Agent):
                 subgoal = sequence.subgoals[i]
                 sg_counter += 1  # for verbose printing
                 # get reward and cost and success of that particular subgoal and store the resulting world
-                subgoal.prior_world = copy.deepcopy(current_world)
+                subgoal.prior_world = current_world.fork()
                 subgoal = self.solve_subgoal(subgoal, verbose=verbose)
                 # replace the subgoal in the sequence with the filled in one
                 sequence.subgoals[i] = subgoal
@@ -343,9 +342,7 @@ class Subgoal_Planning_Agent(BFS_Lookahead_Agent):
         total_costs = 0
         i = 0
         while total_costs < self.max_cost:
-            temp_world = copy.deepcopy(subgoal.prior_world)
-            temp_world.set_silhouette(subgoal.target)
-            temp_world.current_state.clear()  # clear caches
+            temp_world = subgoal.prior_world.fork(silhouette=subgoal.target)
             if temp_world.current_state.possible_actions() == []:
                 # we can't do anything in this world
                 break
@@ -379,7 +376,7 @@ class Subgoal_Planning_Agent(BFS_Lookahead_Agent):
                 )
             if temp_world.status()[0] == "Win":
                 # we've found a solution! write it to the subgoal
-                subgoal.past_world = copy.deepcopy(temp_world)
+                subgoal.past_world = temp_world.fork()
                 subgoal.actions = actions
                 subgoal.C = costs
                 subgoal.solution_cost = costs
@@ -48,7 +48,7 @@ def analyze_single_tower(world, agent, n=1000, verbose=True):
     else:
         iterator = range(n)
     for i in iterator:
-        _world = world.copy()
+        _world = world.fork()
         agent.set_world(_world)
         agent.random_seed = i
         depth = 0
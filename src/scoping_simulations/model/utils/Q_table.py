@@ -65,8 +65,8 @@ class Q_table:
 
 
 def state_key(state):
-    """Returns orderinvariant representation of state as string"""
-    return state.order_invariant_hash()  # slow, but readable
+    """Returns orderinvariant representation of state as 64 bit integer"""
+    return state.zobrist_hash()
 
 
 def action_key(action):
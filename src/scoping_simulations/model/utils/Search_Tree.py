@@ -3,8 +3,10 @@ import copy
 
 
 class Node:
-    """A node holds a state (a blockworld state object) and a list of actions that lead up to the state"""
+    """A node holds a state (a blockworld state object) and a list of actions that lead up to the state. States of a world with a state store are not copied, so that every node of a configuration shares the stored state and its cached values."""
 
     def __init__(self, state, actions):
-        self.state = copy.copy(state)
+        if getattr(getattr(state, "world", None), "state_store", None) is None:
+            state = copy.copy(state)
+        self.state = state
         self.actions = actions
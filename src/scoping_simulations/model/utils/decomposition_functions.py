@@ -60,10 +60,9 @@ class Subgoal:
         self.planning_cost = planning_cost
 
     def key(self):
-        key = self.target * 100 - (
-            self.prior_world.current_state.order_invariant_blockmap() > 0
-        )
-        return key.tostring()  # make hashable
+        # which cells are filled doesn't depend on the order of placement, so the blockmap can be used as is
+        key = self.target * 100 - (self.prior_world.current_state.blockmap > 0)
+        return key.tobytes()  # make hashable
 
     def R(self):
         try:
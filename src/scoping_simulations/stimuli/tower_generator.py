@@ -23,7 +23,7 @@ class TowerGenerator:
         block_library=bl_nonoverlapping_simple,  # list of blocks to choose from
         # function that samples from the distribution of numbers of blocks per tower. Can also pass list or int
         num_blocks=_default_size,
-        # is called after each block is placed and returns true for placements we want to allow
+        # is called with the new state after each block is placed and returns true for placements we want to allow. Eg. `lambda state: state.stability_probability(20, 0.1) > 0.9`
         evaluator=lambda x: True,
         block_selector=random.choice,  # gets the list of blocks and choses one,
         physics=True,  # do we care about the stability of the tower?
@@ -91,7 +91,7 @@ class TowerGenerator:
             # take action
             new_state = world.transition(action)
             # evaluate the new state
-            if world.stability(new_state):
+            if world.stability(new_state) and self.evaluator(new_state):
                 # the block placement is stable, so we can place it
                 world.apply_action(action)
                 num_blocks -= 1
@@ -1,12 +1,15 @@
 import copy
+import json
 import sys
+import weakref
+import zlib
 
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import pyplot
 
 import scoping_simulations.utils.blockworld_helpers as blockworld_helpers
-from scoping_simulations.utils import matter_server
+from scoping_simulations.utils import box2d_physics, matter_server, stability_cache
 from scoping_simulations.utils.world import World
 
 # import scoping_simulations.utils.matter_server as matter_server
@@ -25,7 +28,21 @@ class Blockworld(World):
 
     Dimensions are in y,x. The origin is top left (in accordance with numpy arrays.
 
-    Physics provider should either be "box2d" (legacy) or "matter" or an instantiated matter_server.Physics_Server with a socket to a running physics server which uses matter.js for compatibility with the human experiments (see `matter_server.js`).
+    Physics provider should either be "box2d" (legacy, simulated in process with `box2d_physics.Box2DSimulator`) or "matter" or an instantiated matter_server.Physics_Server with a socket to a running physics server which uses matter.js for compatibility with the human experiments (see `matter_server.js`). A matter_server.PhysicsServerPool can be passed to spread requests over several physics server processes.
+
+    With `stability_prefilter`, configurations that can be decided analytically (every block fully supported or a block tipping over, see `analytic_stability`) are not sent to the physics engine. Off by default: see `benchmark_stability_prefilter.py` for its agreement with the physics providers.
+
+    With `incremental_stability`, a state whose parent state is known to be stable only simulates the part of the tower that the newly placed block could set in motion (see `State.support_cone`) and adds the other blocks as static bodies. This is much faster for tall towers, but an approximation of the full simulation. Only used with matter: Box2D has no static bodies, so it always simulates the full tower.
+
+    With `stability_memo`, the results of physics simulations are kept in memory (`stability_cache.stability_memo`) under a translation invariant key (see `canonical_blocks_key`) and shared between all worlds in the process, so that the same tower at another horizontal offset doesn't need to be simulated again.
+
+    With `component_stability` (and the memo or a cache), towers that consist of several disconnected parts (see `State.components`) are split up: the parts are looked up and simulated on their own, and the tower is stable if all of its parts are. Side by side structures then only need one simulation per new part and position instead of one per combination of parts. Off by default.
+
+    Pass a `stability_cache.StabilityCache` as `stability_cache` to store the results of physics simulations on disk and share them between states, runs and processes.
+
+    Pass a `state_store.StateStore` as `state_store` to share states between the different orders of placing the same blocks: transitions then return the state that is already known for the resulting configuration, along with all of its cached values (stability, scores, actions).
+
+    States are hashed and compared by their `zobrist_hash`, which doesn't depend on the order in which blocks were placed. With `verify_state_equality`, states with equal hashes are only considered equal if they also consist of the same blocks, which guards against hash collisions.
     """
 
     def __init__(
@@ -37,6 +54,13 @@ class Blockworld(World):
         legal_action_space=True,
         physics=True,
         physics_provider="matter",
+        stability_prefilter=False,
+        incremental_stability=False,
+        stability_cache=None,
+        stability_memo=True,
+        component_stability=False,
+        verify_state_equality=True,
+        state_store=None,
     ):
         self.dimension = dimension
         # Defines dimensions of possible blocks.
@@ -61,10 +85,25 @@ class Blockworld(World):
         self.fast_failure = fast_failure
         self.legal_action_space = legal_action_space  # only return legal actions?
         self.physics = physics  # turn physics on or off?
+        # decide trivial cases of stability without physics?
+        self.stability_prefilter = stability_prefilter
+        # only simulate the part of the tower affected by the last block?
+        self.incremental_stability = incremental_stability
+        self.stability_cache = stability_cache  # persistent cache of stability results
+        # share stability results across states and worlds in memory?
+        self.stability_memo = stability_memo
+        # look up and simulate disconnected parts of towers separately?
+        self.component_stability = component_stability
+        # compare the blocks of states with equal hashes?
+        self.verify_state_equality = verify_state_equality
+        self.state_store = state_store  # transposition table of states
         if physics:
             if physics_provider == "box2d":
                 self.physics_provider = "box2d"
-            elif type(physics_provider) == matter_server.Physics_Server:
+                self.box2d_simulator = box2d_physics.Box2DSimulator(
+                    y_height=self.dimension[0]
+                )
+            elif isinstance(physics_provider, matter_server.Physics_Server):
                 self.physics_provider = physics_provider
             elif physics_provider == "matter":
                 # we create the physics provider ourself
@@ -87,6 +126,17 @@ class Blockworld(World):
     def copy(self):
         return copy.deepcopy(self)
 
+    def fork(self, silhouette=None):
+        """Returns a new world that starts from a copy of the current state. Unlike `copy`, the fork shares the block library, the physics provider (`copy` starts a new physics server), the stability cache and the silhouettes with this world, which are never changed in place. Pass a silhouette to give the fork a different silhouette (the full silhouette is kept, like `set_silhouette`)."""
+        world = copy.copy(self)
+        if silhouette is not None:
+            world.silhouette = silhouette
+        if getattr(self, "state_store", None) is not None:
+            # the stored states belong to this world
+            world.state_store = type(self.state_store)(self.state_store.max_entries)
+        world.current_state = self.current_state.fork(world)
+        return world
+
     def transition(self, action, state=None, force=False):
         """Takes an action and a state and returns the resulting state without applying it to the current state of the world."""
         if state is None:
@@ -99,29 +149,52 @@ class Blockworld(World):
             return state
         # check for legality of transition
         if not force:
-            if action not in self.current_state.possible_actions(legal=False):
+            if not self.is_possible_action(action, state):
                 raise Exception("Action not possible")
         # determine y coordinates of block
-        # find the lowest free row in the tower
-        try:
-            y = (
-                int(
-                    np.where(state.blockmap[:, x : x + baseblock.width].any(axis=1))[0][
-                        0
-                    ]
-                )
-                - 1
-            )
-        except IndexError:
-            y = self.dimension[0] - 1
+        # the block lands on the highest filled cell below it
+        skyline = state.skyline
+        y = int(skyline[x : x + baseblock.width].min()) - 1
         # create new block
         new_block = Block(baseblock, x, y)
+        new_block_code = pack_block(new_block)
+        zobrist = state.zobrist_hash() ^ zobrist_key(new_block_code)
+        state_store = getattr(self, "state_store", None)
+        if state_store is not None:
+            # have we seen this configuration before?
+            codes = None
+            if self.verify_state_equality:
+                codes = state.block_codes() + [new_block_code]
+            stored_state = state_store.get(zobrist, codes, self.silhouette)
+            if stored_state is not None:
+                return stored_state
+        # only the new block needs to be written into a copy of the blockmap of the parent
+        blockmap = state.blockmap.copy()
+        blockmap[y - baseblock.height + 1 : y + 1, x : x + baseblock.width] = (
+            len(state.blocks) + 1
+        )
         # create new state
-        new_state = Blockworld.State(self, state.blocks + [new_block])
+        new_state = Blockworld.State(
+            self, state.blocks + [new_block], parent=state, blockmap=blockmap
+        )
+        new_state._skyline = skyline.copy()
+        new_state._skyline[x : x + baseblock.width] = y - baseblock.height + 1
+        # only the columns of the new block can get new holes
+        new_state._hole_counts = state._hole_counts_with_block(new_block)
+        # the hash only changes by the key of the new block
+        new_state._zobrist = zobrist
+        if state_store is not None:
+            state_store.put(zobrist, new_state, self.silhouette)
         return new_state
 
     def status(self):
-        """Expanded status function also returns a reason for failure"""
+        """Expanded status function also returns a reason for failure. Memoized on the current state, see `State.terminal_checks`."""
+        checks = self.current_state.terminal_checks()
+        if "status" not in checks:
+            checks["status"] = self._status()
+        return checks["status"]
+
+    def _status(self):
         if self.is_win():
             return "Win", "None"
         if self.is_fail():
@@ -157,11 +230,73 @@ class Blockworld(World):
             self.full_silhouette = silhouette
         self.current_state.clear()
 
+    def encode_action(self, action):
+        """Returns the integer code of an action: the index of its base block in the block library times the width of the world plus its x location. Codes can be used as array indices, see `State.action_mask`. Base blocks are matched by size, so actions from copies of the world get the same codes."""
+        base_block, x = action
+        if not 0 <= x < self.dimension[1]:
+            raise ValueError("x location " + str(x) + " is outside of the world")
+        block_index = self._block_indices()[(base_block.width, base_block.height)]
+        return block_index * self.dimension[1] + x
+
+    def decode_action(self, code):
+        """Returns the action (BaseBlock from block_library, x location) of an integer code from `encode_action`."""
+        block_index, x = divmod(code, self.dimension[1])
+        return self.block_library[block_index], x
+
+    def _block_indices(self):
+        """Returns a dictionary from the size (width, height) of the base blocks in the block library to their index. Recomputed whenever the block library is replaced."""
+        block_library, block_indices = getattr(
+            self, "_block_library_indices", (None, None)
+        )
+        if block_library is not self.block_library:
+            block_indices = {}
+            for i, base_block in enumerate(self.block_library):
+                block_indices.setdefault((base_block.width, base_block.height), i)
+            self._block_library_indices = (self.block_library, block_indices)
+        return block_indices
+
+    def is_possible_action(self, action, state=None):
+        """Returns True if the block of the action can be placed in the state (in bounds, independent of stability and the silhouette)."""
+        if state is None:
+            state = self.current_state
+        try:
+            code = self.encode_action(action)
+        except (KeyError, ValueError):
+            # not a block from the library or out of the world
+            return False
+        return bool(state.action_mask(legal=False)[code])
+
+    def _outside_silhouette_counts(self):
+        """Returns the 2D prefix sum of the cells outside the silhouette: entry [y, x] counts the cells outside of it in rows < y and columns < x. Recomputed whenever the silhouette is replaced."""
+        silhouette, counts = getattr(self, "_outside_silhouette", (None, None))
+        if silhouette is not self.silhouette:
+            counts = np.zeros(
+                (self.silhouette.shape[0] + 1, self.silhouette.shape[1] + 1), dtype=int
+            )
+            counts[1:, 1:] = (self.silhouette <= 0).cumsum(axis=0).cumsum(axis=1)
+            self._outside_silhouette = (self.silhouette, counts)
+        return counts
+
+    def _silhouette_columns(self):
+        """Returns two lists with a list for every column of the silhouette: the number of cells in the silhouette at or below each row (padded with zeros below the floor) and the first row at or below each row that is in the silhouette (the height of the world if there is none). Used to update hole counts. Recomputed whenever the silhouette is replaced."""
+        silhouette, columns = getattr(self, "_silhouette_column_counts", (None, None))
+        if silhouette is not self.silhouette:
+            target = self.silhouette > 0
+            height, width = target.shape
+            below = np.zeros((height + 2, width), dtype=int)
+            below[:height] = np.cumsum(target[::-1], axis=0)[::-1]
+            rows = np.where(target, np.arange(height)[:, None], height)
+            first = np.full((height + 1, width), height)
+            first[:height] = np.minimum.accumulate(rows[::-1], axis=0)[::-1]
+            columns = (below.T.tolist(), first.T.tolist())
+            self._silhouette_column_counts = (self.silhouette, columns)
+        return columns
+
     """Simple functions inherited from the class World"""
 
     def apply_action(self, action, force=False):
         if not force:
-            if action not in self.current_state.possible_actions(legal=False):
+            if not self.is_possible_action(action):
                 raise Exception("Action not possible")
         self.current_state = self.transition(action, self.current_state, force=force)
 
@@ -170,36 +305,60 @@ class Blockworld(World):
             state = self.current_state
         # should we fail the trial if it can't be completed to save time? Suggested by David.
         if self.fast_failure:
-            if filled_outside(self.current_state) > 0:
-                return True
-            if holes(self.current_state) > 0:
+            checks = self.current_state.terminal_checks()
+            if "fast_fail" not in checks:
+                checks["fast_fail"] = (
+                    filled_outside(self.current_state) > 0
+                    or holes(self.current_state) > 0
+                )
+            if checks["fast_fail"]:
                 return True
-        # always active fail states
-        if state.stability() is False:  # we loose if its unstable
-            return True
-        # we loose if we aren't finished and have no options
-        if state.score(F1score) != 1 and state.possible_actions() == []:
-            return True
-
-        return False
+        checks = state.terminal_checks()
+        if "fail" not in checks:
+            # always active fail states
+            # we loose if its unstable
+            # or if we aren't finished and have no options
+            checks["fail"] = state.stability() is False or (
+                state.score(F1score) != 1 and state.possible_actions() == []
+            )
+        return checks["fail"]
 
     def is_win(self, state=None):
         if state is None:
             state = self.current_state
-        if state.score(F1score) == 1 and state.stability():
+        checks = state.terminal_checks()
+        if "win" not in checks:
+            checks["win"] = bool(state.score(F1score) == 1 and state.stability())
+        if checks["win"]:
             return True
 
     def is_full_win(self, state=None):
         if state is None:
             state = self.current_state
-        # temporarily replace the silhouette with the full one, restore after checking
-        old_silhouette = np.copy(self.silhouette)
-        self.silhouette = self.full_silhouette
-        if state.score(F1score) == 1 and state.stability():
-            self.silhouette = old_silhouette
-            return True
-        self.silhouette = old_silhouette
-        return False
+        checks = state.terminal_checks()
+        if "full_win" not in checks:
+            # score against the full silhouette without touching the cached F1 score
+            checks["full_win"] = bool(
+                F1score_batch(state.blockmap[None], self.full_silhouette)[0] == 1
+                and state.stability()
+            )
+        return checks["full_win"]
+
+    def score_batch(self, states, scoring_function=None):
+        """Same as `score` for a list of states. Determines the stability of all states in one batched request and scores them with `score_batch`."""
+        if len(states) == 0:
+            return []
+        if self.physics:
+            self.stability_batch(states)
+        # fills the cached F1 score used by is_fail and is_win
+        score_batch(states, F1score)
+        scores = list(score_batch(states, scoring_function))
+        for i, state in enumerate(states):
+            if self.is_fail(state):
+                scores[i] = self.fail_penalty
+            elif self.is_win(state):
+                scores[i] = self.win_reward
+        return scores
 
     def score(self, state=None, scoring_function=None):
         if state is None:
@@ -230,31 +389,231 @@ class Blockworld(World):
             state = self.current_state
         return state.stability()
 
+    def stability_batch(self, states):
+        """Returns the stability of each of the passed states as a list of booleans. States whose stability isn't cached yet are sent to the matter physics server in a single batched request, which saves a round trip per state. Caches the values on the states."""
+        if self.physics is False:
+            return [True for state in states]
+        uncached_states = [
+            state
+            for state in states
+            if state._stable is None and not state._lookup_stability()
+        ]
+        # towers that decompose into parts only need their unknown parts simulated
+        # (state, blocks, static blocks, x to shift to 0, whether it's a part of the tower)
+        requests = []
+        requested_components = set()  # parts often recur across the states
+        for state in uncached_states:
+            unknown_components = state._component_stability()
+            if unknown_components is None:
+                requests.append((state, *state._physics_request(), None, False))
+                continue
+            for blocks in unknown_components:
+                key = state._component_key(blocks)
+                if key not in requested_components:
+                    requested_components.add(key)
+                    requests.append(
+                        (state, blocks, [], state._horizontal_offset(), True)
+                    )
+        if requests:
+            stabilities = self._get_stability_batch(
+                [request[1] for request in requests],
+                [request[2] for request in requests],
+                [request[3] for request in requests],
+            )
+            for (state, blocks, static_blocks, min_x, component), stable in zip(
+                requests, stabilities
+            ):
+                if component:
+                    state._store_component_stability(blocks, stable)
+                else:
+                    state._store_stability(stable)
+        # states made of parts now find all of them in the memo or cache
+        return [state.stability() for state in states]
+
+    def _get_stability_batch(
+        self, list_of_blocks, list_of_static_blocks, list_of_min_x=None
+    ):
+        """Runs the physics provider on each of the lists of blocks and returns their stability as a list of booleans. Every configuration is simulated with its blocks in a fixed order and shifted to the left by its entry in `list_of_min_x` (by default the x of its leftmost block, which puts it at x=0), see `canonical_blocks`."""
+        if list_of_min_x is None:
+            list_of_min_x = [None for blocks in list_of_blocks]
+        canonical_requests = [
+            canonical_blocks(blocks, static_blocks, min_x)
+            for blocks, static_blocks, min_x in zip(
+                list_of_blocks, list_of_static_blocks, list_of_min_x
+            )
+        ]
+        list_of_blocks = [blocks for blocks, static_blocks in canonical_requests]
+        list_of_static_blocks = [
+            static_blocks for blocks, static_blocks in canonical_requests
+        ]
+        if self.physics_provider == "box2d":
+            # static blocks only occur with incremental stability, which `State._incremental` restricts to matter
+            return self.box2d_simulator.get_stability_batch(list_of_blocks)
+        return self.physics_provider.get_stability_batch(
+            list_of_blocks, list_of_static_blocks
+        )
+
     class State:
         """This subclass contains a (possible or current) state of the world and implements a range of functions to score it, namely for F1 (how much of the figure are we filling out) and physical stability. It also generates possible actions. The blockworld classes wrap around this class.
         Hashes of this class are orderinvariant as to the order the blocks were placed (but not their positions). Use 'order_sensitive_hash' for an hash that takes placement order of blocks into account.
         """
 
-        def __init__(self, world, blocks):
+        def __init__(self, world, blocks, parent=None, blockmap=None):
+            """Pass the `blockmap` if it is already known (eg. from a transition) to save building it from the blocks. It is used as is, not copied."""
             self.world = world
             self.blocks = blocks
+            # the state this state was created from by a transition. Weak reference, so we don't keep the whole search tree alive. Not pickled.
+            self._parent = weakref.ref(parent) if parent is not None else None
             self.world_width = self.world.dimension[1]
             self.world_height = self.world.dimension[0]
-            # bitmap for placement of blocks
-            self.blockmap = np.zeros((self.world_height, self.world_width), dtype=int)
-            # read the blocks into the blockmap
-            self._update_map_with_blocks(blocks)
+            if blockmap is None:
+                # bitmap for placement of blocks
+                self.blockmap = np.zeros(
+                    (self.world_height, self.world_width), dtype=int
+                )
+                # read the blocks into the blockmap
+                self._update_map_with_blocks(blocks)
+            else:
+                self.blockmap = blockmap
             self._stable = None
+            self._zobrist = None  # Cached zobrist hash, see `zobrist_hash`. ⚠️ It is NOT updated when the blockmap/block list is touched manually! ⚠️
             self._cached_hash = None  # Cached hash value. It's only filled once we actually generate a hash and invalidates when the blockmap is updated. ⚠️ It is NOT updated when the blockmap/block list is touched manually! ⚠️
             self._legal_actions = None  # Cached actions. It's only filled once we actually generate a hash and invalidates when the blockmap is updated. ⚠️ It is NOT updated when the blockmap/block list is touched manually! ⚠️
             self._possible_actions = None  # Cached actions. It's only filled once we actually generate a hash and invalidates when the blockmap is updated. ⚠️ It is NOT updated when the blockmap/block list is touched manually! ⚠️
+            # the silhouette prefix sum that `_legal_actions` was computed with
+            self._legal_actions_counts = None
+            self._hole_counts = None  # Cached hole counts with the silhouette they were counted for, see `holes`
+            self._skyline = None  # Cached top filled row per column, see `skyline`. ⚠️ It is NOT updated when the blockmap/block list is touched manually! ⚠️
+            self._terminal_checks = None  # Memoized win and fail checks with the silhouettes they were made for, see `terminal_checks`
 
         def __eq__(self, other):
             """The order of the blocks does not matter, as they have their location attached. So the sorted list should be equal between two states which consist of the same blocks no matter the order in which they were placed"""
-            return self.order_invariant_hash() == other.order_invariant_hash()
+            if self is other:
+                return True
+            if self.zobrist_hash() != other.zobrist_hash():
+                return False
+            if getattr(self.world, "verify_state_equality", True):
+                # rule out a hash collision
+                return sorted(self.block_codes()) == sorted(other.block_codes())
+            return True
 
         def __hash__(self):
-            return self.order_invariant_hash()
+            return self.zobrist_hash()
+
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            # weak references can't be pickled
+            state["_parent"] = None
+            return state
+
+        def __copy__(self):
+            # shallow copies keep the link to the parent
+            new_state = Blockworld.State.__new__(Blockworld.State)
+            new_state.__dict__.update(self.__dict__)
+            return new_state
+
+        @property
+        def skyline(self):
+            """Array of the index of the topmost filled row in each column (the height of the world for empty columns). Computed from the blockmap on first use, transitions derive it from the skyline of their parent."""
+            if getattr(self, "_skyline", None) is None:
+                filled = self.blockmap > 0
+                self._skyline = np.where(
+                    filled.any(axis=0), filled.argmax(axis=0), self.world_height
+                )
+            return self._skyline
+
+        def terminal_checks(self):
+            """Returns the dictionary in which the world memoizes its status, win and fail checks of the state. It is emptied when the silhouette or the full silhouette of the world is replaced (eg. by `Blockworld.set_silhouette`)."""
+            world = self.world
+            terminal_checks = getattr(self, "_terminal_checks", None)
+            if (
+                terminal_checks is None
+                or terminal_checks[0] is not world.silhouette
+                or terminal_checks[1] is not world.full_silhouette
+            ):
+                terminal_checks = (world.silhouette, world.full_silhouette, {})
+                self._terminal_checks = terminal_checks
+            return terminal_checks[2]
+
+        def holes(self):
+            """Returns the number of holes, see `holes`. Cached for the current silhouette of the world, transitions update the count of their parent in the columns of the new block."""
+            hole_counts = getattr(self, "_hole_counts", None)
+            if hole_counts is None or hole_counts[0] is not self.world.silhouette:
+                hole_counts = self._count_holes()
+                self._hole_counts = hole_counts
+            return hole_counts[3]
+
+        def _count_holes(self):
+            """Returns the silhouette, the topmost built cell in the silhouette for each column (the height of the world if there is none), the number of built cells in the silhouette for each column and the number of holes."""
+            target = self.world.silhouette > 0
+            covering = (self.blockmap > 0) & target
+            tops = np.where(
+                covering.any(axis=0), covering.argmax(axis=0), self.world_height
+            ).tolist()
+            covered = covering.sum(axis=0).tolist()
+            below, _ = self.world._silhouette_columns()
+            number_of_holes = 0
+            for x in range(self.world_width):
+                if tops[x] < self.world_height:
+                    # cells in the silhouette below the top that aren't built
+                    number_of_holes += below[x][tops[x] + 1] - (covered[x] - 1)
+            return self.world.silhouette, tops, covered, number_of_holes
+
+        def _hole_counts_with_block(self, block):
+            """Returns the hole counts (see `_count_holes`) of this state with the block placed on top of it or None if they haven't been counted for the current silhouette yet."""
+            hole_counts = getattr(self, "_hole_counts", None)
+            if hole_counts is None or hole_counts[0] is not self.world.silhouette:
+                return None
+            silhouette, tops, covered, number_of_holes = hole_counts
+            tops = tops.copy()
+            covered = covered.copy()
+            below, first = self.world._silhouette_columns()
+            # the block lies above everything built in its columns
+            block_top = block.y - block.height + 1
+            if block_top < 0 or block.x + block.width > self.world_width:
+                return None  # forced out of the world
+            for x in range(block.x, block.x + block.width):
+                newly_covered = below[x][block_top] - below[x][block.y + 1]
+                if newly_covered == 0:  # the block is outside the silhouette here
+                    continue
+                if tops[x] < self.world_height:
+                    number_of_holes -= below[x][tops[x] + 1] - (covered[x] - 1)
+                tops[x] = first[x][block_top]
+                covered[x] += newly_covered
+                number_of_holes += below[x][tops[x] + 1] - (covered[x] - 1)
+            return silhouette, tops, covered, number_of_holes
+
+        def _lowest_tops(self):
+            """Returns a dictionary from block width to an array of the minimum of the skyline over the columns x to x + width - 1 for every possible x, for all widths in the block library."""
+            skyline = self.skyline
+            max_width = min(
+                max([b.width for b in self.world.block_library], default=0),
+                self.world_width,
+            )
+            lowest_tops = {1: skyline}
+            for width in range(2, max_width + 1):
+                # sliding window minimum built up from the one for the next smaller width
+                lowest_tops[width] = np.minimum(
+                    lowest_tops[width - 1][:-1], skyline[width - 1 :]
+                )
+            return lowest_tops
+
+        def fork(self, world):
+            """Returns a copy of the state in another world (see `Blockworld.fork`) with its own list of blocks and blockmap. Cached values that depend on the silhouette are only kept if the world has the same silhouette."""
+            new_state = copy.copy(self)
+            new_state.world = world
+            new_state.blocks = list(self.blocks)
+            new_state.blockmap = self.blockmap.copy()
+            new_state._parent = None
+            new_state._terminal_checks = None
+            if world.silhouette is not self.world.silhouette:
+                new_state.__dict__.pop("_F1score", None)
+            return new_state
+
+        def parent(self):
+            """Returns the state this state was created from by a transition or None if it is unknown (or has been garbage collected)."""
+            parent = getattr(self, "_parent", None)
+            return parent() if parent is not None else None
 
         def transition(self, action):
             """Takes an action and returns the resulting state without applying it to the current state of the world."""
@@ -265,14 +624,15 @@ class Blockworld(World):
             self._stable = None
             self._legal_actions = None
             self._possible_actions = None
+            self._skyline = None
+            self._hole_counts = None
+            self._terminal_checks = None
             try:
                 del self._F1score
             except:
                 pass
-            try:
-                del self._cached_hash
-            except:
-                pass
+            self._cached_hash = None
+            self._zobrist = None
             # self._update_map_with_blocks(self.blocks)
 
         def order_invariant_blockmap(self):
@@ -298,16 +658,33 @@ class Blockworld(World):
                 # self._cached_hash = self.order_invariant_blockmap().__str__() #Slower, but human readable
             return self._cached_hash
 
+        def block_codes(self):
+            """Returns the blocks packed as integers (see `pack_block`) in the order of placement."""
+            return [pack_block(b) for b in self.blocks]
+
+        def zobrist_hash(self):
+            """Returns a 64 bit integer hash of the blocks that doesn't depend on the order in which they were placed: the XOR of the `zobrist_key` of every block. Transitions update it from the hash of the parent state."""
+            if getattr(self, "_zobrist", None) is None:
+                zobrist = 0
+                for block in self.blocks:
+                    zobrist ^= zobrist_key(pack_block(block))
+                self._zobrist = zobrist
+            return self._zobrist
+
         def order_sensitive_hash(self):
             return self.blockmap.tostring()
 
         def _update_map_with_blocks(self, blocks, delete=False):
             """Fills the blockmap with increasing numbers for each block. 0 is empty space. Original blockmap behavior can be achieved by blockmap > 0."""
-            self._cached_hash = None  # invalidate the hash
+            self._cached_hash = None  # invalidate the hashes
+            self._zobrist = None
+            self._skyline = None  # and the skyline
+            self._hole_counts = None
+            self._terminal_checks = None
+            last_number = np.max(self.blockmap)
             for b in blocks:
-                new_number = (
-                    0 if delete else (np.max(self.blockmap) + 1)
-                )  # numbers increase
+                last_number += 1
+                new_number = 0 if delete else last_number  # numbers increase
                 self.blockmap[
                     (b.y - b.height) + 1 : b.y + 1, b.x : (b.x + b.width)
                 ] = new_number
@@ -333,20 +710,271 @@ class Blockworld(World):
             if self._stable is not None and not visual_display:
                 # return cached value
                 return self._stable
+            if not visual_display and self._lookup_stability():
+                # another state with the same configuration has been simulated before
+                return self._stable
+            unknown_components = None if visual_display else self._component_stability()
+            if unknown_components is not None:
+                # the tower consists of several parts, simulate the unknown ones
+                # parts are simulated where they are in the tower shifted to x=0
+                stabilities = self.world._get_stability_batch(
+                    unknown_components,
+                    [[] for blocks in unknown_components],
+                    [self._horizontal_offset() for blocks in unknown_components],
+                )
+                for blocks, stable in zip(unknown_components, stabilities):
+                    self._store_component_stability(blocks, stable)
+                if self._stable is None:
+                    self._store_stability(all(stabilities))
+                return self._stable
             # we actually need to run the physics engine
-            if self.world.physics_provider == "box2d":
-                bwworld = self.state_to_bwworld()
-                self._stable = (
-                    test_world_stability(bwworld, RENDER=visual_display) == "stable"
+            if self.world.physics_provider == "box2d" and visual_display:
+                # display_world needs pygame, so we only import it when we need to render
+                from scoping_simulations.utils.display_world import (
+                    test_world_stability,
                 )
-                pass
+
+                bwworld = self.state_to_bwworld()
+                stable = test_world_stability(bwworld, RENDER=True) == "stable"
+            elif self.world.physics_provider == "box2d":
+                blocks, static_blocks = canonical_blocks(self.blocks)
+                stable = self.world.box2d_simulator.get_stability(blocks)
             else:
-                assert (
-                    type(self.world.physics_provider).__name__ == "Physics_Server"
+                assert isinstance(
+                    self.world.physics_provider, matter_server.Physics_Server
                 ), "Physics provider must be a Physics_Server object"
-                self._stable = self.world.physics_provider.get_stability(self.blocks)
+                blocks, static_blocks = canonical_blocks(*self._physics_request())
+                stable = self.world.physics_provider.get_stability(
+                    blocks, static_blocks
+                )
+            self._store_stability(stable)
             return self._stable
 
+        def _physics_request(self):
+            """Returns the blocks to simulate and the blocks to add as static bodies to determine the stability of the state.
+            With incremental stability (matter only) and a parent known to be stable, only the support cone of the newly placed block is simulated.
+            """
+            parent = self.parent()
+            if (
+                not self._incremental()
+                or parent is None
+                or parent._stable is not True
+                or parent.blocks != self.blocks[:-1]
+            ):
+                return self.blocks, []
+            cone = self.support_cone()
+            blocks = [b for i, b in enumerate(self.blocks) if i in cone]
+            static_blocks = [b for i, b in enumerate(self.blocks) if i not in cone]
+            return blocks, static_blocks
+
+        def _incremental(self):
+            """Returns True if the world checks stability incrementally (see `_physics_request`). Box2D has no static bodies for the rest of the tower, so it always simulates the full tower."""
+            return (
+                getattr(self.world, "incremental_stability", False)
+                and self.world.physics_provider != "box2d"
+            )
+
+        def support_cone(self, block_index=-1):
+            """Returns the set of indices of the blocks that the given block (by default the last placed one) could set in motion: the blocks that carry its load down to the floor, the block itself and everything resting on these blocks."""
+            block_index = block_index % len(self.blocks)
+
+            def neighbors(i, row):
+                """Indices of the blocks in the given row below/above block i"""
+                b = self.blocks[i]
+                if row < 0 or row >= self.world_height:
+                    return set()
+                numbers = np.unique(self.blockmap[row, b.x : b.x + b.width])
+                # the blockmap numbers blocks starting at 1 in the order of the block list
+                return {int(n) - 1 for n in numbers if n > 0}
+
+            # follow the load down to the floor
+            supporters = set()
+            frontier = [block_index]
+            while frontier:
+                i = frontier.pop()
+                for j in neighbors(i, self.blocks[i].y + 1):
+                    if j not in supporters:
+                        supporters.add(j)
+                        frontier.append(j)
+            # add everything that rests on the supporting blocks
+            cone = supporters | {block_index}
+            frontier = list(supporters)
+            while frontier:
+                i = frontier.pop()
+                b = self.blocks[i]
+                for j in neighbors(i, b.y - b.height):
+                    if j not in cone:
+                        cone.add(j)
+                        frontier.append(j)
+            return cone
+
+        def components(self):
+            """Returns the blocks of the state split into connected parts as a list of lists of blocks. Blocks belong to the same part if they touch, including at a corner. Parts can't influence each other without one of them moving, which already makes the tower unstable, so the tower is stable if and only if all of its parts are."""
+            # union find over the blocks
+            roots = list(range(len(self.blocks)))
+
+            def find(i):
+                while roots[i] != i:
+                    roots[i] = roots[roots[i]]
+                    i = roots[i]
+                return i
+
+            for i, a in enumerate(self.blocks):
+                for j in range(i):
+                    b = self.blocks[j]
+                    # do the blocks touch? (cells are inclusive, so a gap of 0 means touching)
+                    if (
+                        a.x <= b.x + b.width
+                        and b.x <= a.x + a.width
+                        and a.y - a.height <= b.y
+                        and b.y - b.height <= a.y
+                    ):
+                        roots[find(i)] = find(j)
+            components = {}
+            for i, block in enumerate(self.blocks):
+                components.setdefault(find(i), []).append(block)
+            return list(components.values())
+
+        def _component_stability(self):
+            """Looks up the stability of the connected parts of the tower (see `components`) in the stability memo and the world's stability cache. Returns the lists of blocks of the parts that still need to be simulated, or None if the tower isn't split up. If the stability of the state follows from the known parts, it is stored and an empty list is returned."""
+            if not getattr(self.world, "component_stability", False):
+                return None
+            if (
+                not getattr(self.world, "stability_memo", False)
+                and getattr(self.world, "stability_cache", None) is None
+            ):
+                # we'd have nowhere to keep the results of the parts
+                return None
+            if self._incremental():
+                # the support cone already restricts the simulation
+                return None
+            components = self.components()
+            if len(components) <= 1:
+                return None
+            unknown_components = []
+            for blocks in components:
+                stable = self._lookup_key(
+                    self._component_key(blocks), self._horizontal_offset()
+                )
+                if stable is False:
+                    # one falling part is enough
+                    self._store_stability(False)
+                    return []
+                if stable is None:
+                    unknown_components.append(blocks)
+            if len(unknown_components) == 0:
+                self._store_stability(True)
+            return unknown_components
+
+        def _store_component_stability(self, blocks, stable):
+            """Stores the stability of a part of the tower in the stability memo and the world's stability cache."""
+            self._store_key(
+                self._component_key(blocks), stable, self._horizontal_offset()
+            )
+
+        def _component_key(self, blocks):
+            """Returns the key for the stability of a part of the tower: the key of its blocks and their distance from the leftmost block of the tower. The physics engines don't give exactly the same result for a part at every horizontal offset, so parts are simulated at that distance from x=0, where they are in the tower when it is simulated as a whole."""
+            distance = self._horizontal_offset(blocks) - self._horizontal_offset()
+            return self._stability_key(blocks) + f"@{distance}".encode()
+
+        def stability_cache_key(self):
+            """Returns the key under which the stability of this state is stored in the stability memo and the world's stability cache. The key describes the configuration of blocks independent of the order of placement and the horizontal offset (see `canonical_blocks_key`), the physics provider and its simulation parameters."""
+            if self._incremental():
+                # incremental results are an approximation, keep them separate
+                return self._stability_key_prefix(
+                    "matter_incremental"
+                ) + canonical_blocks_key(self.blocks, self.world_height)
+            return self._stability_key(self.blocks)
+
+        def _stability_key(self, blocks):
+            """Returns the key for the stability of the blocks when simulated in full by the physics provider of the world."""
+            return self._stability_key_prefix() + canonical_blocks_key(
+                blocks, self.world_height
+            )
+
+        def _stability_key_prefix(self, name=None):
+            """Returns the start of the stability keys of the physics provider of the world: its name and its simulation parameters (see `stability_key_prefix`)."""
+            if self.world.physics_provider == "box2d":
+                config = self.world.box2d_simulator.simulation_config()
+                name = name or "box2d"
+            else:
+                config = self.world.physics_provider.simulation_config()
+                name = name or "matter"
+            return stability_key_prefix(name, config)
+
+        def _horizontal_offset(self, blocks=None):
+            """Returns the x coordinate of the leftmost block."""
+            if blocks is None:
+                blocks = self.blocks
+            return min([b.x for b in blocks], default=0)
+
+        def _lookup_stability(self):
+            """Fills the stability of the state from the analytic pre-filter, the stability memo or the world's stability cache. Returns True if the stability was found."""
+            if getattr(self.world, "stability_prefilter", False):
+                analytic_result = analytic_stability(self.blockmap, self.blocks)
+                if analytic_result != "uncertain":
+                    self._stable = analytic_result == "stable"
+                    return True
+            stable = self._lookup_key(
+                self.stability_cache_key(), self._horizontal_offset()
+            )
+            if stable is None:
+                return False
+            self._stable = stable
+            return True
+
+        def _store_stability(self, stable):
+            """Caches the stability on the state and in the world's stability cache."""
+            self._stable = stable
+            self._store_key(
+                self.stability_cache_key(), stable, self._horizontal_offset()
+            )
+
+        def _lookup_key(self, key, offset):
+            """Returns the stability stored under the key in the stability memo or the world's stability cache, or None if it's in neither."""
+            use_memo = getattr(self.world, "stability_memo", False)
+            if use_memo:
+                stable = stability_cache.stability_memo.get(key, offset)
+                if stable is not None:
+                    return stable
+            cache = getattr(self.world, "stability_cache", None)
+            if cache is None:
+                return None
+            stable = cache.get(key)
+            if stable is not None and use_memo:
+                stability_cache.stability_memo.put(key, stable, offset)
+            return stable
+
+        def _store_key(self, key, stable, offset):
+            """Stores the stability under the key in the stability memo and the world's stability cache."""
+            if getattr(self.world, "stability_memo", False):
+                stability_cache.stability_memo.put(key, stable, offset)
+            cache = getattr(self.world, "stability_cache", None)
+            if cache is not None:
+                cache.put(key, stable)
+
+        def stability_probability(self, n_samples=100, noise=0.1):
+            """Returns the fraction of `n_samples` copies of the configuration that are stable when every block is shifted horizontally by gaussian noise with standard deviation `noise` (in grid cells). All copies are sent to the physics provider in one batched request.
+            The noise is seeded by the configuration, so the result is reproducible, and it is kept in `stability_cache.stability_probability_memo` under the translation invariant key of the configuration.
+            """
+            if self.world.physics is False:
+                return 1.0
+            key = self._stability_key(self.blocks) + f":{n_samples}:{noise}".encode()
+            offset = self._horizontal_offset()
+            probability = stability_cache.stability_probability_memo.get(key, offset)
+            if probability is not None:
+                return probability
+            rng = np.random.default_rng(zlib.crc32(key))
+            # perturb the configuration at x=0, so the samples only depend on the key
+            blocks, static_blocks = canonical_blocks(self.blocks)
+            samples = [perturb_blocks(blocks, noise, rng) for i in range(n_samples)]
+            stabilities = self.world._get_stability_batch(
+                samples, [[] for sample in samples]
+            )
+            probability = float(np.mean(stabilities)) if n_samples > 0 else 1.0
+            stability_cache.stability_probability_memo.put(key, probability, offset)
+            return probability
+
         def is_win(self):
             return self.world.is_win(state=self)
 
@@ -364,31 +992,65 @@ class Blockworld(World):
             if self._possible_actions is not None:
                 return self._possible_actions
             possible_actions = []
+            lowest_tops = self._lowest_tops()
             for base_block in self.world.block_library:
                 # starting coordinate is bottom left. The block can't possible overlap the right side.
-                for x in range(self.world_width - base_block.width + 1):
-                    # and whether it overlaps the top boundary by simply looking if the block at the top is free
-                    if (
-                        np.sum(
-                            self.blockmap[
-                                0 : base_block.height, x : x + base_block.width
-                            ]
-                        )
-                        == 0
-                    ):
-                        possible_actions.append((base_block, x))
+                if base_block.width > self.world_width:
+                    continue
+                # the block fits if the top `height` rows are free in all of its columns
+                possible_actions += [
+                    (base_block, int(x))
+                    for x in np.flatnonzero(
+                        lowest_tops[base_block.width] >= base_block.height
+                    )
+                ]
             self._possible_actions = possible_actions
             return possible_actions
 
+        def action_mask(self, legal=None):
+            """Returns a boolean array over the integer codes of actions (see `Blockworld.encode_action`) that is True for the actions returned by `possible_actions`."""
+            actions = self.possible_actions(legal=legal)
+            # the mask is cached along with the list of actions it was made from
+            cached_actions, mask = getattr(self, "_action_mask", (None, None))
+            if cached_actions is not actions:
+                mask = np.zeros(
+                    len(self.world.block_library) * self.world_width, dtype=bool
+                )
+                mask[[self.world.encode_action(a) for a in actions]] = True
+                self._action_mask = (actions, mask)
+            return mask
+
         def legal_actions(self):
             """Returns the subset of possible actions where the placed block is fully within the silhouette. Returns [] if the current state is already non-legal."""
-            if self._legal_actions is not None:
+            outside_counts = self.world._outside_silhouette_counts()
+            # the cached actions are only valid for the silhouette they were computed for
+            if (
+                self._legal_actions is not None
+                and getattr(self, "_legal_actions_counts", None) is outside_counts
+            ):
                 return self._legal_actions
-            legal_actions = [
-                a
-                for a in self.possible_actions(legal=False)
-                if legal(self.transition(a))
-            ]  # need legal false here to prevent infinite recursion
+            legal_actions = []
+            if legal(self):
+                lowest_tops = self._lowest_tops()
+                for base_block in self.world.block_library:
+                    if base_block.width > self.world_width:
+                        continue
+                    tops = lowest_tops[base_block.width]
+                    xs = np.flatnonzero(tops >= base_block.height)
+                    # the block covers the rows from top to bottom (exclusive) where it lands
+                    bottom = tops[xs]
+                    top = bottom - base_block.height
+                    right = xs + base_block.width
+                    # number of cells of the block outside the silhouette
+                    outside = (
+                        outside_counts[bottom, right]
+                        - outside_counts[top, right]
+                        - outside_counts[bottom, xs]
+                        + outside_counts[top, xs]
+                    )
+                    legal_actions += [(base_block, int(x)) for x in xs[outside == 0]]
+            self._legal_actions = legal_actions
+            self._legal_actions_counts = outside_counts
             return legal_actions
 
         def visual_display(self, blocking=False, silhouette=None):
@@ -444,6 +1106,90 @@ class Blockworld(World):
             """Pass an action. Returns True if that action doesn't decrease F1 score, False otherwise"""
             return F1score(self) <= F1score(self.transition(action))
 
+        def compact(self):
+            """Returns a memory efficient `CompactState` of this state, eg. to keep in a search frontier. Its stability is carried over if it is known."""
+            rows = tuple(
+                int.from_bytes(np.packbits(row, bitorder="little").tobytes(), "little")
+                for row in self.blockmap > 0
+            )
+            codes = tuple(pack_block(b) for b in self.blocks)
+            return Blockworld.CompactState(self.world, rows, codes, self._stable)
+
+    class CompactState:
+        """A state of the world that takes about half the memory of a `State` (460 instead of 970 bytes for 6 blocks in an 8x8 world), for search frontiers that hold many states. Occupancy is kept as one integer bitboard per row (bit x is set if the cell in column x is filled) and the blocks as a tuple of integer codes (see `pack_block`). The blockmap and the list of blocks are only built on demand.
+        Create one with `State.compact()` and use `expand()` to get a full `State` back for transitions and scoring. Equality and hashing are order invariant like for `State`.
+        """
+
+        __slots__ = ("world", "rows", "codes", "_stable")
+
+        def __init__(self, world, rows, codes, stable=None):
+            self.world = world
+            self.rows = rows  # occupancy bitboard per row, top row first
+            self.codes = codes  # packed blocks in the order of placement
+            self._stable = stable
+
+        def __eq__(self, other):
+            return sorted(self.codes) == sorted(other.codes)
+
+        def __hash__(self):
+            return hash(frozenset(self.codes))
+
+        def __len__(self):
+            return len(self.codes)
+
+        def expand(self):
+            """Returns the full `State`. If the world has a state store, the stored state of the configuration is returned if there is one."""
+            state_store = getattr(self.world, "state_store", None)
+            if state_store is not None:
+                zobrist = 0
+                for code in self.codes:
+                    zobrist ^= zobrist_key(code)
+                codes = list(self.codes) if self.world.verify_state_equality else None
+                state = state_store.get(zobrist, codes, self.world.silhouette)
+                if state is not None:
+                    return state
+            state = Blockworld.State(self.world, self.blocks)
+            state._stable = self._stable
+            if state_store is not None:
+                state_store.put(zobrist, state, self.world.silhouette)
+            return state
+
+        @property
+        def blocks(self):
+            """The list of blocks, built from the codes."""
+            return [unpack_block(code, self.world.block_library) for code in self.codes]
+
+        @property
+        def blockmap(self):
+            """The blockmap with blocks numbered in order of placement, built from the codes."""
+            blockmap = np.zeros(self.world.dimension, dtype=int)
+            for i, code in enumerate(self.codes):
+                x, y, width, height = unpack_block_code(code)
+                blockmap[y - height + 1 : y + 1, x : x + width] = i + 1
+            return blockmap
+
+        @property
+        def bitmap(self):
+            """Boolean occupancy of the cells, built from the bitboards."""
+            width = self.world.dimension[1]
+            return np.array(
+                [[(row >> x) & 1 for x in range(width)] for row in self.rows],
+                dtype=bool,
+            )
+
+        def is_free(self, x, y, width=1, height=1):
+            """Returns True if no cell of the rectangle with bottom left corner at (x, y) (origin top left) is filled."""
+            mask = ((1 << width) - 1) << x
+            return all(
+                self.rows[row] & mask == 0 for row in range(y - height + 1, y + 1)
+            )
+
+        def stability(self):
+            """Returns the stability of the state, expanding it to run the physics if it isn't known yet."""
+            if self._stable is None:
+                self._stable = self.expand().stability()
+            return self._stable
+
 
 class Block:
     """
@@ -576,13 +1322,31 @@ class Block:
     """
 
 
+_base_blocks = {}
+
+
 class BaseBlock:
     """
     Base Block class for defining a block object with attributes.
     Adapted from block_construction/stimuli/blockworld_helpers.py
+
+    Base blocks are interned: there is only one instance for every width, height, shape and color, which is returned by the constructor and kept by copies and pickles. Actions (BaseBlock, x) of different copies of a world can thus be compared directly.
     """
 
+    def __new__(cls, width=None, height=1, shape="rectangle", color="gray"):
+        if width is None:
+            # unpickling base blocks pickled before they were interned calls __new__ without arguments
+            return super().__new__(cls)
+        key = (cls, width, height, shape, color)
+        base_block = _base_blocks.get(key)
+        if base_block is None:
+            base_block = super().__new__(cls)
+            _base_blocks[key] = base_block
+        return base_block
+
     def __init__(self, width=1, height=1, shape="rectangle", color="gray"):
+        if "base_verts" in self.__dict__:  # interned instance is already initialized
+            return
         self.base_verts = np.array(
             [(0, 0), (0, 1 * height), (1 * width, 1 * height), (1 * width, 0), (0, 0)]
         )
@@ -594,6 +1358,20 @@ class BaseBlock:
     def __str__(self):
         return "(" + str(self.width) + "x" + str(self.height) + ")"
 
+    def __reduce__(self):
+        # unpickle to the interned instance
+        return (
+            self.__class__,
+            (self.width, self.height, self.shape, self.color),
+            self.__dict__,
+        )
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def init(self):
         self.corners = self.get_corners(self.base_verts)
         self.area = self.get_area(shape=self.shape)
@@ -641,6 +1419,148 @@ class BaseBlock:
         return area
 
 
+def pack_block(block):
+    """Packs the position and size of a block into a single integer (8 bits each for x, y, width and height)."""
+    return block.x | block.y << 8 | block.width << 16 | block.height << 24
+
+
+_zobrist_keys = {}
+
+
+def zobrist_key(code):
+    """Returns the random 64 bit key of a block packed with `pack_block` for the zobrist hash of states. Keys are generated with splitmix64 from the code, so they are the same in every process."""
+    key = _zobrist_keys.get(code)
+    if key is None:
+        key = (code + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        key = key ^ (key >> 31)
+        _zobrist_keys[code] = key
+    return key
+
+
+def unpack_block_code(code):
+    """Returns x, y, width and height of a block packed with `pack_block`."""
+    return code & 0xFF, code >> 8 & 0xFF, code >> 16 & 0xFF, code >> 24 & 0xFF
+
+
+def unpack_block(code, block_library=()):
+    """Returns the Block packed with `pack_block`. Uses the base block of the same size from the block library if there is one."""
+    x, y, width, height = unpack_block_code(code)
+    for base_block in block_library:
+        if base_block.width == width and base_block.height == height:
+            return Block(base_block, x, y)
+    return Block(BaseBlock(width, height), x, y)
+
+
+def canonical_blocks_key(blocks, y_height):
+    """Returns a compact bytes key for a list of blocks that is the same for every placement order and horizontal offset of the configuration. The physics engines don't give exactly the same result at every horizontal offset (rounding decides borderline towers), so configurations are simulated shifted to x=0 and with their blocks in the order of the key (see `canonical_blocks`): the stability stored under a key then only depends on the key, not on where and in which order the configuration was seen first.
+    The blocks are shifted so that the leftmost block is at x=0, their y coordinate is counted from the floor so that worlds of different height share keys, and the sorted (x, y, width, height) tuples are packed as 16 bit integers.
+    """
+    if len(blocks) == 0:
+        return b""
+    min_x = min([b.x for b in blocks])
+    canonical_blocks = sorted(
+        [(b.x - min_x, y_height - 1 - b.y, b.width, b.height) for b in blocks]
+    )
+    return np.array(canonical_blocks, dtype=np.uint16).tobytes()
+
+
+_stability_key_prefixes = {}
+
+
+def stability_key_prefix(name, config):
+    """Returns the start of the stability keys of a physics provider, eg. b"matter:1c291ca3:": its name and a hash of the dictionary of its simulation parameters. Simulations with different parameters (like early exit) can come to different results, so they mustn't share results in the stability memo and cache."""
+    config_key = (name, tuple(sorted(config.items())))
+    prefix = _stability_key_prefixes.get(config_key)
+    if prefix is None:
+        digest = zlib.crc32(json.dumps(config, sort_keys=True).encode("utf-8"))
+        prefix = f"{name}:{digest:08x}:".encode()
+        _stability_key_prefixes[config_key] = prefix
+    return prefix
+
+
+def canonical_blocks(blocks, static_blocks=(), min_x=None):
+    """Returns the blocks and the static blocks as they are simulated: shifted horizontally by `min_x` to the left (as copies) and sorted like in `canonical_blocks_key`, since the physics engines also depend on the order in which the bodies are added. By default, they are shifted so that the leftmost of them is at x=0."""
+    if min_x is None:
+        min_x = min([b.x for b in list(blocks) + list(static_blocks)], default=0)
+
+    def shift(block):
+        if min_x == 0:
+            return block
+        shifted_block = copy.copy(block)
+        shifted_block.x = block.x - min_x
+        return shifted_block
+
+    def canonical(blocks):
+        return sorted([shift(b) for b in blocks], key=lambda b: (b.x, -b.y))
+
+    return canonical(blocks), canonical(static_blocks)
+
+
+def perturb_blocks(blocks, noise, rng):
+    """Returns copies of the blocks shifted horizontally by gaussian noise with standard deviation `noise` (in grid cells). Blocks are shifted from left to right (independent of the order of placement) and pushed back to the right where they would overlap a block to their left, as overlapping bodies would be pushed apart by the physics engine."""
+    perturbed_blocks = []
+    for block in sorted(blocks, key=lambda b: (b.x, b.y)):
+        perturbed_block = copy.copy(block)
+        x = block.x + rng.normal(0, noise)
+        for other in perturbed_blocks:
+            # does the other block share rows with this one?
+            if other.y - other.height < block.y and block.y - block.height < other.y:
+                x = max(x, other.x + other.width)
+        perturbed_block.x = float(x)
+        perturbed_blocks.append(perturbed_block)
+    return perturbed_blocks
+
+
+def analytic_stability(blockmap, blocks):
+    """Decides the stability of a configuration without running a physics engine where that's trivially possible. Returns "stable", "unstable" or "uncertain".
+
+    The configuration is stable if every block rests with its whole base on the floor or on other blocks. It is unstable if a block has its center of mass outside the span of the cells supporting it (or no support at all) while nothing rests on it and nothing touches its sides or corners (a block touching another one only at a corner can come to rest on it). Everything else is uncertain and needs to be simulated.
+    """
+    if len(blocks) == 0:
+        return "stable"
+    height, width = blockmap.shape
+    filled = blockmap > 0
+    xs = np.array([b.x for b in blocks])
+    ys = np.array([b.y for b in blocks])
+    ws = np.array([b.width for b in blocks])
+    hs = np.array([b.height for b in blocks])
+    cols = np.arange(width)
+    rows = np.arange(height)
+    in_block_cols = (cols >= xs[:, None]) & (cols < (xs + ws)[:, None])  # (n, width)
+    # the row below the bottom of each block, with the floor as a filled row
+    grounded = np.vstack([filled, np.ones((1, width), dtype=bool)])
+    support = in_block_cols & grounded[ys + 1]
+    n_support = support.sum(axis=1)
+    if (n_support == ws).all():
+        return "stable"
+    # span of the cells supporting each block
+    support_left = np.where(support, cols, width).min(axis=1)
+    support_right = np.where(support, cols, -1).max(axis=1) + 1
+    center_of_mass = xs + ws / 2
+    outside = (n_support == 0) | (center_of_mass < support_left)
+    outside |= center_of_mass > support_right
+    # is something resting on top of the block? (the row above the top of the block, with empty space above the world)
+    ceiling = np.vstack([np.zeros((1, width), dtype=bool), filled])
+    loaded = (in_block_cols & ceiling[ys - hs + 1]).any(axis=1)
+    # is something touching the sides of the block, including diagonally at a corner?
+    # (n, height) the rows of the block and the rows above and below it
+    in_block_rows = (rows >= (ys - hs)[:, None]) & (rows <= (ys + 1)[:, None])
+    walls = np.hstack(
+        [
+            np.zeros((height, 1), dtype=bool),
+            filled,
+            np.zeros((height, 1), dtype=bool),
+        ]
+    )
+    touching = (in_block_rows & walls[:, xs].T).any(axis=1)
+    touching |= (in_block_rows & walls[:, xs + ws + 1].T).any(axis=1)
+    if (outside & ~loaded & ~touching).any():
+        return "unstable"
+    return "uncertain"
+
+
 """Scoring functions. These should be passed to the scoring function of the state. Note that these operate on the blockmap, not the blocks."""
 
 
@@ -731,17 +1651,16 @@ def legal(state):
 
 def holes(state):
     """Returns the number of cells that are in the silhouette, but not built, but have something built on top of them. This tracks the number of holes."""
-    target = state.world.silhouette > 0
-    built = (state.blockmap > 0) * 2
-    mapped = target + built
-    holes = 0
-    for x in range(built.shape[1]):  # we don't need to check the bottom
-        for y in range(built.shape[0] - 1):
-            if mapped[y, x] == 3:  # if we have a cell with blck and in silhouette
-                # if blocks below is not built and in silhouette
-                holes = holes + np.sum(mapped[y + 1 :, x] == 1)
-                break  # since we're going through from the top, we don't need to iterate further
-    return holes
+    if isinstance(state, Blockworld.State):
+        return state.holes()
+    return np.sum(column_holes(state.blockmap > 0, state.world.silhouette > 0))
+
+
+def column_holes(built, target):
+    """Returns the number of holes in every column of a boolean map of built cells (or a stack of them) given the boolean map of the silhouette: cells in the silhouette that are not built, but lie below the topmost built cell inside the silhouette in their column."""
+    # cells at or below the topmost built cell in the silhouette of their column
+    below = np.logical_or.accumulate(built & target, axis=-2)
+    return np.sum(below & target & ~built, axis=-2)
 
 
 def silhouette_hole_score(state):
@@ -769,3 +1688,131 @@ def sparse(state):
 def cells_left(state):
     """The number of cells not yet filled out in the silhouette"""
     return np.sum(((state.world.silhouette > 0) - (state.blockmap > 0)) > 0)
+
+
+"""Batched scoring kernels. They take an (N, H, W) stack of blockmaps and the silhouette and return an array of N scores, computed in one pass. Same values as the scoring functions above."""
+
+
+def stack_blockmaps(states):
+    """Returns the blockmaps of the states as an (N, H, W) array."""
+    return np.stack([state.blockmap for state in states])
+
+
+def _built_and_target(blockmaps, silhouette):
+    """Returns the built cells of the stack of blockmaps and the cells of the silhouette as boolean arrays."""
+    return np.asarray(blockmaps) > 0, np.asarray(silhouette) > 0
+
+
+def F1score_batch(blockmaps, silhouette):
+    """F1 score of every blockmap in the stack, see `F1score`."""
+    # smallest possible float to prevent division by zero. Not the prettiest of hacks
+    s = sys.float_info[3]
+    built, target = _built_and_target(blockmaps, silhouette)
+    inside = np.sum(built & target, axis=(1, 2))
+    precision = inside / (np.sum(built, axis=(1, 2)) + s)
+    recall = inside / (np.sum(target) + s)
+    return 2 * (precision * recall) / (precision + recall + s)
+
+
+def precision_batch(blockmaps, silhouette):
+    """Precision of every blockmap in the stack, see `precision`."""
+    s = sys.float_info[3]
+    built, target = _built_and_target(blockmaps, silhouette)
+    return np.sum(built & target, axis=(1, 2)) / (np.sum(built, axis=(1, 2)) + s)
+
+
+def recall_batch(blockmaps, silhouette):
+    """Recall of every blockmap in the stack, see `recall`."""
+    s = sys.float_info[3]
+    built, target = _built_and_target(blockmaps, silhouette)
+    return np.sum(built & target, axis=(1, 2)) / (np.sum(target) + s)
+
+
+def filled_inside_batch(blockmaps, silhouette):
+    """Number of cells built inside the silhouette for every blockmap in the stack."""
+    built, target = _built_and_target(blockmaps, silhouette)
+    return np.sum(built & target, axis=(1, 2))
+
+
+def filled_outside_batch(blockmaps, silhouette):
+    """Number of cells built outside the silhouette for every blockmap in the stack."""
+    built, target = _built_and_target(blockmaps, silhouette)
+    return np.sum(built & ~target, axis=(1, 2))
+
+
+def silhouette_score_batch(blockmaps, silhouette, fail_penalty):
+    """Silhouette score of every blockmap in the stack, see `silhouette_score`."""
+    built, target = _built_and_target(blockmaps, silhouette)
+    ssize = np.sum(target)
+    reward = np.sum(built & target, axis=(1, 2)) / ssize
+    penalty = np.sum(built & ~target, axis=(1, 2)) / ssize
+    return reward + penalty * fail_penalty
+
+
+def holes_batch(blockmaps, silhouette):
+    """Number of holes of every blockmap in the stack, see `holes`."""
+    built, target = _built_and_target(blockmaps, silhouette)
+    return np.sum(column_holes(built, target), axis=-1)
+
+
+def _F1scores(states, blockmaps):
+    """F1 scores of the states. Uses and fills the cache of `F1score`."""
+    uncached = [i for i, state in enumerate(states) if not hasattr(state, "_F1score")]
+    if uncached:
+        scores = F1score_batch(blockmaps[uncached], states[0].world.silhouette)
+        for i, score in zip(uncached, scores):
+            states[i]._F1score = score
+    return np.array([state._F1score for state in states])
+
+
+def _instabilities(states):
+    """1 for every unstable state and 0 for every stable one, simulated in one batched request."""
+    return 1 - np.array(states[0].world.stability_batch(states), dtype=float)
+
+
+def _silhouette_hole_scores(states, blockmaps):
+    world = states[0].world
+    scores = silhouette_score_batch(blockmaps, world.silhouette, world.fail_penalty)
+    return scores + world.fail_penalty * holes_batch(blockmaps, world.silhouette)
+
+
+def _F1_stability_scores(states, blockmaps):
+    scores = _F1scores(states, blockmaps)
+    return scores + states[0].world.fail_penalty * _instabilities(states)
+
+
+def _silhouette_hole_stability_scores(states, blockmaps):
+    scores = _silhouette_hole_scores(states, blockmaps)
+    return scores + states[0].world.fail_penalty * _instabilities(states)
+
+
+def _silhouette_kernel(kernel):
+    """Wraps a batched kernel that only needs the silhouette to take the states."""
+    return lambda states, blockmaps: kernel(blockmaps, states[0].world.silhouette)
+
+
+# scoring functions of states and their batched versions over (states, stacked blockmaps)
+_batch_scoring_functions = {
+    F1score: _F1scores,
+    precision: _silhouette_kernel(precision_batch),
+    recall: _silhouette_kernel(recall_batch),
+    filled_inside: _silhouette_kernel(filled_inside_batch),
+    filled_outside: _silhouette_kernel(filled_outside_batch),
+    holes: _silhouette_kernel(holes_batch),
+    silhouette_score: lambda states, blockmaps: silhouette_score_batch(
+        blockmaps, states[0].world.silhouette, states[0].world.fail_penalty
+    ),
+    silhouette_hole_score: _silhouette_hole_scores,
+    F1_stability_score: _F1_stability_scores,
+    silhouette_hole_stability_score: _silhouette_hole_stability_scores,
+}
+
+
+def score_batch(states, scoring_function):
+    """Returns the scores of a list of states of the same world as an array. Scoring functions with a batched kernel score all states in one pass over their stacked blockmaps (and one batched stability request), others are called on every state."""
+    if len(states) == 0:
+        return np.array([])
+    batch_scoring_function = _batch_scoring_functions.get(scoring_function)
+    if batch_scoring_function is None:
+        return np.array([scoring_function(state) for state in states])
+    return batch_scoring_function(states, stack_blockmaps(states))
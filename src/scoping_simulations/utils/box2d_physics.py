@@ -0,0 +1,167 @@
+"""In-process stability checks with Box2D for the "box2d" physics provider of the Blockworld.
+
+`display_world.test_world_stability` always simulates 250 steps and imports pygame for rendering. `Box2DSimulator` stops simulating once the tower has come to rest and can check a whole batch of configurations in one call. It is the fallback for machines without node (and thus without the matter physics server).
+
+Every check gets a fresh Box2D world. Reusing one world and only swapping the bodies saves about 15 microseconds per check, but the results then depend on which configurations were simulated before (the broadphase hands out proxy ids and thus orders contacts differently), which we can't have for a cache of stability results.
+
+Usage:
+    simulator = Box2DSimulator(y_height=8)
+    simulator.get_stability(state.blocks)
+    simulator.get_stability_batch([state.blocks for state in states])
+"""
+
+import numpy as np
+
+try:
+    import Box2D
+except ImportError:
+    Box2D = None
+
+
+def _make_b2world():
+    """Returns a new Box2D world with the same ground body as in `display_world.test_world_stability`."""
+    b2world = Box2D.b2World(gravity=(0, -10), doSleep=False)
+    ground = b2world.CreateStaticBody(
+        position=(0, -10),
+        shapes=Box2D.b2PolygonShape(box=(50, 10)),
+    )
+    return b2world, ground
+
+
+class Box2DSimulator:
+    """Determines the stability of configurations of blocks (`blockworld.Block`, origin top left) with Box2D. Gives the same results as `display_world.test_world_stability`.
+
+    Positions are compared between step `start_step` and step `max_steps` like in `test_world_stability`. With `early_exit`, bodies are allowed to fall asleep and the simulation stops once all blocks are asleep or moving slower than `velocity_threshold` (and rotating slower than `angular_velocity_threshold`) at two checks `rest_steps` steps apart, or as soon as a block has moved far enough to make the tower unstable. See `benchmark_box2d.py` for the speedup and the agreement with the full simulation. Without `early_exit`, the full legacy simulation is run.
+
+    The simulator only holds its parameters, so it can be pickled and shared between threads.
+    """
+
+    def __init__(
+        self,
+        y_height=8,
+        early_exit=True,
+        velocity_threshold=0.001,
+        angular_velocity_threshold=0.001,
+        rest_steps=10,
+        time_step=0.01,
+        vel_iters=10,
+        pos_iters=10,
+        start_step=5,
+        max_steps=250,
+    ) -> None:
+        if Box2D is None:
+            raise ImportError(
+                "Box2D not installed. Legacy physics engine will not work."
+            )
+        # needed to flip the y axis, since Box2D has its origin at the bottom
+        self.y_height = y_height
+        self.early_exit = early_exit
+        self.velocity_threshold = velocity_threshold
+        self.angular_velocity_threshold = angular_velocity_threshold
+        self.rest_steps = rest_steps
+        self.time_step = time_step
+        self.vel_iters = vel_iters
+        self.pos_iters = pos_iters
+        self.start_step = start_step
+        self.max_steps = max_steps
+
+    def simulation_config(self):
+        """Returns the parameters that the result of a simulation depends on as a dictionary."""
+        return {
+            "early_exit": self.early_exit,
+            "velocity_threshold": self.velocity_threshold,
+            "angular_velocity_threshold": self.angular_velocity_threshold,
+            "rest_steps": self.rest_steps,
+            "time_step": self.time_step,
+            "vel_iters": self.vel_iters,
+            "pos_iters": self.pos_iters,
+            "start_step": self.start_step,
+            "max_steps": self.max_steps,
+        }
+
+    def get_stability(self, blocks):
+        """Returns True if the configuration of blocks is stable, False otherwise."""
+        return self.test_stability(blocks) == "stable"
+
+    def get_stability_batch(self, list_of_blocks):
+        """Returns the stability of each of the given lists of blocks as a list of booleans."""
+        return [self.get_stability(blocks) for blocks in list_of_blocks]
+
+    def test_stability(self, blocks):
+        """Simulates the blocks and returns a string like `display_world.test_world_stability`:
+        'stable' if no blocks fall
+        'big move' if at least one block moves a large distance
+        'lots of small diffs' if multiple blocks move a small distance
+        """
+        b2world, ground = _make_b2world()
+        bodies = self._add_blocks(b2world, blocks)
+        b2world.allowSleeping = self.early_exit
+        resting = False
+        for step in range(1, self.max_steps + 1):
+            b2world.Step(self.time_step, self.vel_iters, self.pos_iters)
+            if step == self.start_step:
+                start_positions = self._positions(ground, bodies)
+            # checking every step would cost more than the steps we save
+            if (
+                self.early_exit
+                and step > self.start_step
+                and step % self.rest_steps == 0
+            ):
+                positions = self._positions(ground, bodies)
+                if (np.absolute(positions - start_positions) > 0.1).any():
+                    # a block that has fallen doesn't come back
+                    return "big move"
+                if self._at_rest(bodies):
+                    if resting:
+                        break
+                    resting = True
+                else:
+                    resting = False
+        end_positions = self._positions(ground, bodies)
+        return check_if_blocks_moved(start_positions, end_positions)
+
+    def _add_blocks(self, b2world, blocks):
+        """Adds a body for each block to the world like `display_world.add_block_to_world`. Returns the list of bodies."""
+        bodies = []
+        for block in blocks:
+            if block.width == 0 or block.height == 0:  # skip empty blocks
+                continue
+            # the bottom row of the block counted from the floor
+            y = self.y_height - block.y - 1
+            body = b2world.CreateDynamicBody(
+                position=(block.x + block.width / 2, y + block.height / 2)
+            )
+            body.CreatePolygonFixture(
+                box=(block.width / 2, block.height / 2),
+                density=1,
+                friction=0.3,
+            )
+            bodies.append(body)
+        return bodies
+
+    def _positions(self, ground, bodies):
+        """Returns the positions of the ground and the blocks as an array. The ground is included to match the averaging in `test_world_stability`."""
+        return np.array([tuple(ground.position)] + [tuple(b.position) for b in bodies])
+
+    def _at_rest(self, bodies):
+        """Returns True if every block is asleep or moving slower than the thresholds."""
+        for body in bodies:
+            if not body.awake:
+                continue
+            if (
+                body.linearVelocity.length > self.velocity_threshold
+                or abs(body.angularVelocity) > self.angular_velocity_threshold
+            ):
+                return False
+        return True
+
+
+def check_if_blocks_moved(start_positions, end_positions):
+    """Same check as `display_world.check_if_blocks_moved`, which we can't import without pygame."""
+    move_diffs = np.absolute(np.subtract(start_positions, end_positions))
+    if (move_diffs > 0.1).any():
+        return "big move"
+    elif sum(sum(move_diffs)) / len(start_positions) > 1:
+        return "lots of small diffs"
+    else:
+        return "stable"
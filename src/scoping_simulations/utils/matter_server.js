@@ -5,7 +5,7 @@ var debug = false;
 var busy = false;
 
 var parseBlocks = function (data) {
-  // blocks have x, y, w, h
+  // blocks have x, y, w, h and optionally s (static: the block is fixed in place)
   // for matter, y is upper corner of area. 0,0 is top left, with y decreasing as we go up the area
   // left is x = 0
   // positions specify the midpoint of a rectangle
@@ -17,6 +17,7 @@ var parseBlocks = function (data) {
       y: y_to_coord(Number(obj.y), Number(obj.h)),
       w: Number(obj.w),
       h: Number(obj.h),
+      static: Boolean(obj.s),
     };
     blocks.push(block);
   }
@@ -36,12 +37,14 @@ var setupWorldWithBlocks = function (blocks) {
   // add each block to the world
   for (var i = 0; i < blocks.length; i++) {
     var block = blocks[i];
+    // static blocks are known to be stable and are fixed in place
+    var options = block.static ? staticBlockOptions : Block.options;
     var b = Bodies.rectangle(
       block.x,
       block.y,
       block.w * sF * worldScale,
       block.h * sF * worldScale,
-      Block.options
+      options
     );
     World.add(engine.world, b); //this where a block gets added to matter
   }
@@ -54,6 +57,16 @@ const SIM_TIME = 5000; //1.5 seconds is what the timeout in the browser is set t
 const FRAME_LENGTH = 1000 / 60;
 const DROP_OFFSET = 1.72849999999994; // in matter units, how much to drop all blocks to see if they're stable? This value is determined, uh, empirically from the webcode.
 
+// Early exit: stop simulating once all blocks have come to rest instead of always simulating SIM_TIME.
+// Off by default to keep the fixed-duration behavior of the human experiments. Set from python with a {"config": {...}} message.
+var config = {
+  earlyExit: false,
+  velocityThreshold: 0.05, // speed (matter units per frame) under which a block counts as resting
+  angularVelocityThreshold: 0.001, // angular speed (radians per frame) under which a block counts as resting
+  restFrames: 30, // number of consecutive frames all blocks need to be resting
+  minFrames: 60, // never stop before this many frames
+};
+
 var checkStability = function () {
   // get the starting positions of all blocks
   var start_positions = [];
@@ -66,6 +79,7 @@ var checkStability = function () {
       angle: block.angle,
     });
   }
+  var restingFrames = 0; // consecutive frames in which all blocks have been resting
   // we need to run the engine in increments, long time steps break it
   for (var t = 0; t < SIM_TIME / FRAME_LENGTH; t++) {
     Engine.update(engine, FRAME_LENGTH);
@@ -86,6 +100,24 @@ var checkStability = function () {
         return false;
       }
     }
+    if (config.earlyExit) {
+      // check if all blocks have come to rest
+      var resting = true;
+      for (var i = 1; i < world.bodies.length; i++) {
+        var block = world.bodies[i];
+        if (
+          block.speed > config.velocityThreshold ||
+          Math.abs(block.angularVelocity) > config.angularVelocityThreshold
+        ) {
+          resting = false;
+          break;
+        }
+      }
+      restingFrames = resting ? restingFrames + 1 : 0;
+      if (t + 1 >= config.minFrames && restingFrames >= config.restFrames) {
+        break;
+      }
+    }
   }
   if (debug) {
     display();
@@ -99,6 +131,8 @@ var Matter = require("matter-js");
 
 var Block = require("../utils/block.js");
 
+var staticBlockOptions = Object.assign({}, Block.options, { isStatic: true });
+
 // Aliases for Matter functions—made global for imported functions
 (global.Engine = Matter.Engine),
   (global.World = Matter.World),
@@ -183,24 +217,146 @@ function display() {
   cp.execSync("python utils/matterjs_visualization.py " + vert_string);
 }
 
-// read stdin
-var stdin = process.openStdin();
-stdin.addListener("data", function (d) {
-  var msg = d;
-  try{
-    var data = JSON.parse(msg);
-    var blocks = parseBlocks(data);
-  } catch (e) {
-    console.log("json_error");
-    return;
-  }
+var runSimulation = function (blocks) {
   while (busy) {} // wait for previous simulation to finish
   busy = true;
   setupWorldWithBlocks(blocks);
   var stable = checkStability();
-  // write result out to stdout
-  console.log(stable);
   busy = false;
+  return stable;
+};
+
+// Binary protocol, see the top of matter_server.py for the layout of the frames
+const MESSAGE_STABILITY = 0;
+const MESSAGE_CONTROL = 1;
+const STATUS_UNSTABLE = 0;
+const STATUS_STABLE = 1;
+const STATUS_ERROR = 2;
+var binaryMode = false; // switched with a {"protocol": "binary"/"text"} control message
+
+var handleControl = function (data) {
+  // control messages set the simulation config and/or switch the protocol after acknowledging
+  if (data.config !== undefined) {
+    Object.assign(config, data.config);
+  }
+};
+
+var isControl = function (data) {
+  return (
+    data !== null &&
+    !Array.isArray(data) &&
+    (data.config !== undefined || data.protocol !== undefined)
+  );
+};
+
+var handleMessage = function (msg) {
+  // a message is either a single list of blocks, {"batch": [list of blocks, ...]} or a control message
+  try {
+    var data = JSON.parse(msg);
+    if (isControl(data)) {
+      handleControl(data);
+      console.log("ok");
+      if (data.protocol !== undefined) binaryMode = data.protocol === "binary";
+      return;
+    }
+    if (data !== null && !Array.isArray(data) && Array.isArray(data.batch)) {
+      var configurations = data.batch.map(parseBlocks);
+    } else {
+      var blocks = parseBlocks(data);
+    }
+  } catch (e) {
+    console.log("json_error");
+    return;
+  }
+  if (configurations !== undefined) {
+    // simulate every configuration and write out a single vector of results
+    var results = configurations.map(runSimulation);
+    console.log(JSON.stringify(results));
+  } else {
+    // write result out to stdout
+    console.log(runSimulation(blocks));
+  }
+};
+
+var writeBinaryResponse = function (requestId, statuses) {
+  var response = Buffer.alloc(6 + statuses.length);
+  response.writeUInt32LE(requestId, 0);
+  response.writeUInt16LE(statuses.length, 4);
+  for (var i = 0; i < statuses.length; i++) {
+    response.writeUInt8(statuses[i], 6 + i);
+  }
+  process.stdout.write(response);
+};
+
+var handleBinaryMessage = function (payload) {
+  var type = payload.readUInt8(0);
+  var requestId = payload.readUInt32LE(1);
+  if (type === MESSAGE_CONTROL) {
+    try {
+      var data = JSON.parse(payload.toString("utf8", 5));
+    } catch (e) {
+      writeBinaryResponse(requestId, [STATUS_ERROR]);
+      return;
+    }
+    handleControl(data);
+    writeBinaryResponse(requestId, [STATUS_STABLE]);
+    if (data.protocol !== undefined) binaryMode = data.protocol === "binary";
+    return;
+  }
+  var configurations = [];
+  try {
+    var nConfigurations = payload.readUInt16LE(5);
+    var offset = 7;
+    for (var c = 0; c < nConfigurations; c++) {
+      var nBlocks = payload.readUInt16LE(offset);
+      offset += 2;
+      var data = [];
+      for (var b = 0; b < nBlocks; b++) {
+        data.push({
+          x: payload.readFloatLE(offset),
+          y: payload.readFloatLE(offset + 4),
+          w: payload.readFloatLE(offset + 8),
+          h: payload.readFloatLE(offset + 12),
+          s: payload.readUInt8(offset + 16),
+        });
+        offset += 17;
+      }
+      configurations.push(parseBlocks(data));
+    }
+  } catch (e) {
+    writeBinaryResponse(requestId, [STATUS_ERROR]);
+    return;
+  }
+  var statuses = configurations.map(function (blocks) {
+    return runSimulation(blocks) ? STATUS_STABLE : STATUS_UNSTABLE;
+  });
+  writeBinaryResponse(requestId, statuses);
+};
+
+// read stdin message by message—large (batched) messages can arrive split over several chunks
+// in text mode, a message is a line; in binary mode, a length-prefixed frame
+var stdin = process.openStdin();
+var stdinBuffer = Buffer.alloc(0);
+stdin.addListener("data", function (d) {
+  stdinBuffer = Buffer.concat([stdinBuffer, d]);
+  while (true) {
+    if (binaryMode) {
+      if (stdinBuffer.length < 4) break;
+      var length = stdinBuffer.readUInt32LE(0);
+      if (stdinBuffer.length < 4 + length) break;
+      var payload = stdinBuffer.subarray(4, 4 + length);
+      stdinBuffer = stdinBuffer.subarray(4 + length);
+      handleBinaryMessage(payload);
+    } else {
+      var newline = stdinBuffer.indexOf(10); // "\n"
+      if (newline === -1) break;
+      var line = stdinBuffer.toString("utf8", 0, newline);
+      stdinBuffer = stdinBuffer.subarray(newline + 1);
+      if (line.trim() !== "") {
+        handleMessage(line);
+      }
+    }
+  }
 });
 
 console.log("ready");
@@ -1,15 +1,74 @@
 # This file contains helper functions for the matter physics server
 
+import asyncio
 import atexit
 import copyreg
+import json
+import math
 import os
+import queue
 import subprocess
 import re
+import struct
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 js_location = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), "matter_server.js"
 )
 
+# Binary protocol. Every request is a frame of a uint32 payload length followed by the payload: a uint8 message type, a uint32 request id and the message.
+# Stability messages hold a uint16 number of configurations, each a uint16 number of blocks followed by x, y, w, h as float32 and a uint8 static flag per block.
+# Control messages hold a JSON object (see `Physics_Server._send_control`).
+# Every response is the uint32 request id, a uint16 number of results and one status byte per result.
+# All numbers are little endian.
+MESSAGE_STABILITY = 0
+MESSAGE_CONTROL = 1
+STATUS_UNSTABLE = 0
+STATUS_STABLE = 1
+STATUS_ERROR = 2
+
+
+def simulation_config(
+    early_exit=False,
+    velocity_threshold=0.05,
+    angular_velocity_threshold=0.001,
+    rest_frames=30,
+    min_frames=60,
+):
+    """Returns the parameters of the simulation in the format the node process expects. See `Physics_Server` for their meaning."""
+    return {
+        "earlyExit": bool(early_exit),
+        "velocityThreshold": float(velocity_threshold),
+        "angularVelocityThreshold": float(angular_velocity_threshold),
+        "restFrames": int(rest_frames),
+        "minFrames": int(min_frames),
+    }
+
+
+def pack_stability_request(
+    request_id, list_of_blocks, list_of_static_blocks, y_height=8
+):
+    """Packs the configurations into a binary request frame with the given request id. The y axis is flipped for matter, so we need the height of the world."""
+    parts = [struct.pack("<BIH", MESSAGE_STABILITY, request_id, len(list_of_blocks))]
+    for blocks, static_blocks in zip(list_of_blocks, list_of_static_blocks):
+        parts.append(struct.pack("<H", len(blocks) + len(static_blocks)))
+        for block, static in [(b, 0) for b in blocks] + [(b, 1) for b in static_blocks]:
+            parts.append(
+                struct.pack(
+                    "<4fB",
+                    block.x,
+                    y_height - 1 - block.y,
+                    block.width,
+                    block.height,
+                    static,
+                )
+            )
+    payload = b"".join(parts)
+    return struct.pack("<I", len(payload)) + payload
+
 
 def launch_process():
     """Launches the matter physics server and return a handle to the process."""
@@ -20,28 +79,73 @@ def launch_process():
         stderr=subprocess.PIPE,
     )
     # wait for process to finish starting
-    process.stdout.readline()  # the process prints "ready" when it's ready
+    ready = process.stdout.readline()  # the process prints "ready" when it's ready
+    if len(ready) == 0:
+        # the process exited before it was ready (eg. because matter-js is missing), starting it again won't help
+        process.wait()
+        raise ValueError(
+            f"Physics server could not be started: {process.stderr.read().decode('utf-8')}"
+        )
     return process
 
 
-# launch the server on import
-process = launch_process()
-# print("Started matter physics server 🧱.")
+# the server is launched lazily on the first request, so importing this module (eg. for analysis) doesn't need node
+process = None
 
 
 def check_process():
-    """Checks if the process is still running and restarts if not."""
+    """Checks if the process is running and (re)starts it if not."""
     global process
-    if process.poll() is not None:
+    if process is None or process.poll() is not None:
         process = launch_process()
         # print("Restarted matter physics server 🧱.")
 
 
 class Physics_Server:
-    def __init__(self, y_height=8) -> None:
+    """Handle to the matter physics server.
+
+    The `protocol` is either "text" (a line of JSON per request) or "binary" (length-prefixed frames of packed blocks, see the top of this file), which saves serialization and parsing at high query rates. It is negotiated with the node process at startup.
+
+    The node process is only started on the first request. Call `warm_up()` to start it ahead of latency-sensitive code.
+
+    By default, every configuration is simulated for the full 5 seconds like in the human experiments. With `early_exit`, the simulation stops once all blocks have moved slower than `velocity_threshold` (and rotated slower than `angular_velocity_threshold`) for `rest_frames` consecutive frames, but never before `min_frames` frames. See `benchmark_early_exit.py` for the speedup and the agreement with the full simulation.
+    """
+
+    # how often a request is resent to a restarted server before we give up
+    MAX_RETRIES = 3
+
+    # parameters of the simulation that are sent to the node process
+    SIMULATION_PARAMETERS = (
+        "early_exit",
+        "velocity_threshold",
+        "angular_velocity_threshold",
+        "rest_frames",
+        "min_frames",
+        "protocol",
+    )
+
+    def __init__(
+        self,
+        y_height=8,
+        early_exit=False,
+        velocity_threshold=0.05,
+        angular_velocity_threshold=0.001,
+        rest_frames=30,
+        min_frames=60,
+        protocol="text",
+    ) -> None:
         # if the height of the canvas differs, we need to subtract it to flip the y axis. 8 is default
         self.y_height = y_height
-        self.start_server()
+        self.early_exit = early_exit
+        self.velocity_threshold = velocity_threshold
+        self.angular_velocity_threshold = angular_velocity_threshold
+        self.rest_frames = rest_frames
+        self.min_frames = min_frames
+        if protocol not in ["text", "binary"]:
+            raise ValueError(f"Protocol must be 'text' or 'binary', got {protocol}")
+        self.protocol = protocol
+        self._next_request_id = 0
+        self._process = None  # started lazily on the first request
 
     def __del__(self):
         """Called when the object is deleted."""
@@ -54,68 +158,544 @@ class Physics_Server:
         check_process()
         self._process = process
 
+    def warm_up(self):
+        """Starts and configures the matter physics server now rather than on the first request, so the first request doesn't pay for it."""
+        self.get_stability([])
+
+    def simulation_config(self):
+        """Returns the parameters of the simulation in the format the node process expects."""
+        return simulation_config(
+            self.early_exit,
+            self.velocity_threshold,
+            self.angular_velocity_threshold,
+            self.rest_frames,
+            self.min_frames,
+        )
+
+    def _configure(self, process):
+        """Negotiates the protocol and sends the parameters of the simulation to the process if it is configured differently. Processes can be shared between servers, so we remember the configuration on the process."""
+        if getattr(process, "protocol", "text") != self.protocol:
+            self._send_control(process, {"protocol": self.protocol})
+            process.protocol = self.protocol
+        config = self.simulation_config()
+        if getattr(process, "simulation_config", None) != config:
+            self._send_control(process, {"config": config})
+            process.simulation_config = config
+
+    def _send_control(self, process, message):
+        """Sends a control message to the process in the protocol it currently speaks and checks that it is acknowledged."""
+        if getattr(process, "protocol", "text") == "binary":
+            payload = struct.pack("<BI", MESSAGE_CONTROL, 0) + json.dumps(
+                message
+            ).encode("utf-8")
+            process.stdin.write(struct.pack("<I", len(payload)) + payload)
+            process.stdin.flush()
+            answer = self._read_binary_response(process)
+            acknowledged = answer == bytes([STATUS_STABLE])
+        else:
+            process.stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+            process.stdin.flush()
+            answer = remove_ansi_codes(process.stdout.readline().decode("utf-8"))
+            acknowledged = answer == "ok\n"
+        if len(answer) == 0:
+            # the process has died—handled like a failed request
+            raise BrokenPipeError("Physics server died while being configured")
+        if not acknowledged:
+            raise ValueError(
+                f"Unexpected output from physics server while configuring: {answer}"
+            )
+
+    def _read_binary_response(self, process, request_id=None):
+        """Reads a response frame from the process and returns the status bytes. Returns empty bytes if the process has died."""
+        header = process.stdout.read(6)
+        if len(header) < 6:
+            return b""
+        response_id, n_results = struct.unpack("<IH", header)
+        statuses = process.stdout.read(n_results)
+        if request_id is not None and response_id != request_id:
+            raise ValueError(
+                f"Physics server answered request {response_id}, but we expected {request_id}"
+            )
+        return statuses
+
+    def _encode_binary_request(self, list_of_blocks, list_of_static_blocks):
+        """Packs the configurations into a binary request frame."""
+        request_id = self._next_request_id
+        self._next_request_id = (self._next_request_id + 1) % 2**32
+        return pack_stability_request(
+            request_id, list_of_blocks, list_of_static_blocks, self.y_height
+        )
+
+    def _decode_binary_response(self, statuses, n_results, request):
+        """Turns the status bytes of a response into a list of booleans."""
+        if len(statuses) != n_results or STATUS_ERROR in statuses:
+            self._raise_unexpected_output(statuses, request)
+        return [status == STATUS_STABLE for status in statuses]
+
     def kill_server(self):
         """Kills the matter physics server."""
+        if self._process is None:
+            return
         try:
             self._process.kill()
-        except:
-            pass
+        except (ProcessLookupError, BrokenPipeError, OSError):
+            pass  # already gone
+        # reap it, so that `check_process` starts a new one
+        self._process.wait()
 
-    def blocks_to_serializable(self, blocks):
-        return [self.block_to_serializable(block) for block in blocks]
+    def blocks_to_serializable(self, blocks, static_blocks=()):
+        return [self.block_to_serializable(block) for block in blocks] + [
+            self.block_to_serializable(block, static=True) for block in static_blocks
+        ]
 
-    def block_to_serializable(self, block):
-        """Returns a serializable version of the block."""
-        return {
+    def block_to_serializable(self, block, static=False):
+        """Returns a serializable version of the block. Static blocks are fixed in place in the simulation."""
+        serialized_block = {
             "x": float(block.x),
             "y": float(self.y_height - 1 - block.y),
             "w": float(block.width),
             "h": float(block.height),
         }
+        if static:
+            serialized_block["s"] = 1
+        return serialized_block
 
-    def get_stability(self, blocks):
+    def get_stability(self, blocks, static_blocks=()):
         """Returns the stability of the given blocks.
         Blocks until the result is known.
+        `static_blocks` are added to the simulation as fixed bodies—use this for parts of the tower that are already known to be stable.
         """
+        if self.protocol == "binary":
+            request = self._encode_binary_request([blocks], [static_blocks])
+            return self._decode_binary_response(
+                self._send_request(request), 1, request
+            )[0]
         serialized_blocks = (
-            str(self.blocks_to_serializable(blocks)).replace("'", '"') + "\n"
+            str(self.blocks_to_serializable(blocks, static_blocks)).replace("'", '"')
+            + "\n"
         )
-        # send the request to the process via stdin
-        try:
-            self._process.stdin.write(serialized_blocks.encode("utf-8"))
-            self._process.stdin.flush()
-            # read the result from the process
-            result = self._process.stdout.readline().decode("utf-8")
-            # when launched from Jupyter Notebook we sometimes get ANSI codes back
-            result = remove_ansi_codes(result)
-        except BrokenPipeError:
-            # if the process is dead, restart it
-            print(f"Physics server ({self._process.pid}) died. Restarting...")
-            error_output = self._process.stderr.read().decode('utf-8')
-            print(f"Error from Node.js process: {error_output}")
-            self.kill_server()
-            self.start_server()
-            return self.get_stability(blocks)
+        result = self._send_request(serialized_blocks)
         # return the result
         if result == "true\n":
             return True
         elif result == "false\n":
             return False
-        elif result == "json_error\n":
+        else:
+            self._raise_unexpected_output(result, serialized_blocks)
+
+    def get_stability_batch(self, list_of_blocks, list_of_static_blocks=None):
+        """Returns the stability of each of the given lists of blocks as a list of booleans.
+        All configurations are sent to the physics server in a single message, so we only pay for one round trip. Blocks until all results are known.
+        `list_of_static_blocks` optionally holds the static blocks for each configuration (see `get_stability`).
+        """
+        if len(list_of_blocks) == 0:
+            return []
+        if list_of_static_blocks is None:
+            list_of_static_blocks = [() for blocks in list_of_blocks]
+        if self.protocol == "binary":
+            request = self._encode_binary_request(list_of_blocks, list_of_static_blocks)
+            return self._decode_binary_response(
+                self._send_request(request), len(list_of_blocks), request
+            )
+        serialized_batch = (
+            json.dumps(
+                {
+                    "batch": [
+                        self.blocks_to_serializable(blocks, static_blocks)
+                        for blocks, static_blocks in zip(
+                            list_of_blocks, list_of_static_blocks
+                        )
+                    ]
+                }
+            )
+            + "\n"
+        )
+        result = self._send_request(serialized_batch)
+        try:
+            stabilities = json.loads(result)
+        except json.JSONDecodeError:
+            self._raise_unexpected_output(result, serialized_batch)
+        if type(stabilities) is not list or len(stabilities) != len(list_of_blocks):
+            self._raise_unexpected_output(result, serialized_batch)
+        return [bool(stable) for stable in stabilities]
+
+    def _send_request(self, serialized_request):
+        """Sends a single line (or binary frame) to the physics server and returns the line it answers with (or the status bytes of the response). Restarts the server if it has died, at most `MAX_RETRIES` times."""
+        if self._process is None or self._process.poll() is not None:
+            self.start_server()
+        for attempt in range(self.MAX_RETRIES + 1):
+            # send the request to the process via stdin
+            try:
+                return self._communicate(self._process, serialized_request)
+            except BrokenPipeError:
+                pass
+            # if the process is dead, restart it
+            print(f"Physics server ({self._process.pid}) died. Restarting...")
+            error_output = self._process.stderr.read().decode("utf-8")
+            print(f"Error from Node.js process: {error_output}")
+            self.kill_server()
+            if attempt < self.MAX_RETRIES:
+                self.start_server()
+        raise ValueError(
+            f"Physics server died {self.MAX_RETRIES + 1} times on input: {serialized_request}"
+        )
+
+    def _communicate(self, process, serialized_request):
+        """Writes a request to the process and reads its answer. Returns an empty answer if the process has died."""
+        self._configure(process)
+        if type(serialized_request) is bytes:
+            process.stdin.write(serialized_request)
+            process.stdin.flush()
+            # the request id sits after the frame length and the message type
+            request_id = struct.unpack_from("<I", serialized_request, 5)[0]
+            return self._read_binary_response(process, request_id)
+        process.stdin.write(serialized_request.encode("utf-8"))
+        process.stdin.flush()
+        # read the result from the process
+        # when launched from Jupyter Notebook we sometimes get ANSI codes back
+        return remove_ansi_codes(process.stdout.readline().decode("utf-8"))
+
+    def _raise_unexpected_output(self, result, serialized_request):
+        """Raises an informative error for output of the physics server that we can't parse."""
+        if result == "json_error\n":
             raise ValueError(
-                f"Physics server reports json error: {self._process.stderr.read().decode('utf-8')} Input was: {serialized_blocks}"
+                f"Physics server reports json error: {self._process.stderr.read().decode('utf-8')} Input was: {serialized_request}"
             )
-        else:
+        raise ValueError(
+            f"Unexpected output from physics server: {result}\nInput was: {serialized_request}\nFull output: {result}."
+        )
+
+
+class PhysicsServerPool(Physics_Server):
+    """Manages several matter physics server processes and hands each request to an idle one, so that concurrent callers (threads, async tasks) don't serialize on a single pipe.
+    Batched requests are split across all workers and simulated in parallel. Workers that crash are restarted and the request they were working on is sent again.
+    Can be passed as `physics_provider` to a Blockworld just like a `Physics_Server`. Use `stats()` to get queue depth and latency counters.
+    """
+
+    def __init__(self, n_workers=None, y_height=8, **simulation_parameters) -> None:
+        """Other keyword arguments are parameters of the simulation, see `Physics_Server`."""
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        self.n_workers = n_workers
+        self._workers = []
+        self._idle_workers = queue.Queue()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self.reset_counters()
+        super().__init__(y_height=y_height, **simulation_parameters)
+        _pools.add(self)
+
+    def start_server(self):
+        """Launches worker processes until the pool has `n_workers` of them."""
+        while len(self._workers) < self.n_workers:
+            worker = launch_process()
+            self._workers.append(worker)
+            self._idle_workers.put(worker)
+
+    def warm_up(self):
+        """Starts and configures all workers now rather than on the first requests."""
+        self._start_workers()
+        # take every worker out of the pool to make sure that each one is configured
+        workers = [self._idle_workers.get() for _ in range(self.n_workers)]
+        try:
+            for worker in workers:
+                self._configure(worker)
+        finally:
+            for worker in workers:
+                self._idle_workers.put(worker)
+
+    def _start_workers(self):
+        """Starts the workers if that hasn't happened yet."""
+        if len(self._workers) < self.n_workers:
+            with self._start_lock:
+                self.start_server()
+
+    def kill_server(self):
+        """Kills all worker processes of the pool."""
+        for worker in self._workers:
+            try:
+                worker.kill()
+            except (ProcessLookupError, BrokenPipeError, OSError):
+                pass  # already gone
+        self._workers = []
+        self._idle_workers = queue.Queue()
+
+    def reset_counters(self):
+        """Resets the request and latency counters."""
+        with self._lock:
+            self._queue_depth = 0
+            self._in_flight = 0
+            self._requests = 0
+            self._restarts = 0
+            self._total_latency = 0.0
+            self._max_latency = 0.0
+
+    def stats(self):
+        """Returns a dictionary of the current queue depth (requests waiting for an idle worker), requests in flight, number of finished requests, number of worker restarts and mean/max latency in seconds."""
+        with self._lock:
+            return {
+                "n_workers": self.n_workers,
+                "queue_depth": self._queue_depth,
+                "in_flight": self._in_flight,
+                "requests": self._requests,
+                "restarts": self._restarts,
+                "mean_latency": self._total_latency / max(self._requests, 1),
+                "max_latency": self._max_latency,
+            }
+
+    def get_stability_batch(self, list_of_blocks, list_of_static_blocks=None):
+        """Returns the stability of each of the given lists of blocks as a list of booleans. The batch is split into one chunk per worker and the chunks are simulated in parallel."""
+        if len(list_of_blocks) <= 1 or self.n_workers == 1:
+            return super().get_stability_batch(list_of_blocks, list_of_static_blocks)
+        if list_of_static_blocks is None:
+            list_of_static_blocks = [() for blocks in list_of_blocks]
+        chunk_size = math.ceil(len(list_of_blocks) / self.n_workers)
+        starts = range(0, len(list_of_blocks), chunk_size)
+        results = self._executor.map(
+            super().get_stability_batch,
+            [list_of_blocks[i : i + chunk_size] for i in starts],
+            [list_of_static_blocks[i : i + chunk_size] for i in starts],
+        )
+        return [stable for chunk_result in results for stable in chunk_result]
+
+    def _send_request(self, serialized_request):
+        """Sends a single line to an idle worker and returns the line it answers with. Blocks until a worker is available. If the worker dies, it is restarted and the request is sent again."""
+        self._start_workers()
+        with self._lock:
+            self._queue_depth += 1
+        worker = self._idle_workers.get()
+        with self._lock:
+            self._queue_depth -= 1
+            self._in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            for _ in range(self.MAX_RETRIES + 1):
+                try:
+                    result = self._communicate(worker, serialized_request)
+                    if len(result) > 0:
+                        return result
+                except BrokenPipeError:
+                    pass
+                # an empty answer means the worker has died
+                worker = self._restart_worker(worker)
             raise ValueError(
-                f"Unexpected output from physics server: {result}\nInput was: {serialized_blocks}\nFull output: {result}."
+                f"Physics server pool: worker died {self.MAX_RETRIES + 1} times on input: {serialized_request}"
             )
-            # print(f"Unexpected output from physics server: {result}\nInput was: {serialized_blocks}Full output: {self._process.stdout.read().decode('utf-8')}.")
-            # print("Restarting physics server...")
-            # self.kill_server()
-            # self.start_server()
-            # # wait a little while
-            # time.sleep(1)
-            return self.get_stability(blocks)
+        finally:
+            latency = time.perf_counter() - start_time
+            with self._lock:
+                self._in_flight -= 1
+                self._requests += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+            self._idle_workers.put(worker)
+
+    def _restart_worker(self, worker):
+        """Replaces a dead worker with a freshly launched one."""
+        try:
+            worker.kill()
+        except (ProcessLookupError, BrokenPipeError, OSError):
+            pass  # already gone
+        new_worker = launch_process()
+        with self._lock:
+            self._restarts += 1
+            if worker in self._workers:
+                self._workers[self._workers.index(worker)] = new_worker
+            else:
+                self._workers.append(new_worker)
+        return new_worker
+
+    def _raise_unexpected_output(self, result, serialized_request):
+        """Raises an informative error for output of a worker that we can't parse."""
+        raise ValueError(
+            f"Unexpected output from physics server pool: {result}\nInput was: {serialized_request}"
+        )
+
+
+class AsyncPhysicsServer:
+    """Asyncio client for the matter physics server. Requests are tagged with ids and sent without waiting for the previous answer, so many requests can be in flight on the pipe of each node process. Futures are resolved as the responses arrive.
+
+    Use the binary protocol internally. With `n_workers` > 1, each request goes to the worker with the fewest outstanding requests and batches are split across workers. Workers that die are restarted and their outstanding requests are sent again.
+
+    Usage:
+        async with AsyncPhysicsServer() as server:
+            stabilities = await asyncio.gather(
+                *[server.get_stability(state.blocks) for state in states]
+            )
+
+    Other keyword arguments are parameters of the simulation, see `Physics_Server`. The processes belong to the event loop they were started in.
+    """
+
+    def __init__(self, y_height=8, n_workers=1, **simulation_parameters) -> None:
+        self.y_height = y_height
+        self.n_workers = n_workers
+        self.config = simulation_config(**simulation_parameters)
+        self._workers = []
+        self._next_request_id = 0
+        self._start_lock = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """Launches the worker processes. Does not need to be called manually—workers will be started on the first request."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            while len(self._workers) < self.n_workers:
+                worker = _AsyncWorker(self)
+                await worker.launch()
+                self._workers.append(worker)
+
+    async def close(self):
+        """Kills the worker processes."""
+        for worker in self._workers:
+            await worker.close()
+        self._workers = []
+
+    def outstanding_requests(self):
+        """Returns the number of requests that have been sent, but not answered yet."""
+        return sum(len(worker.pending) for worker in self._workers)
+
+    async def get_stability(self, blocks, static_blocks=()):
+        """Returns the stability of the given blocks. See `Physics_Server.get_stability`."""
+        return (await self._request([blocks], [static_blocks]))[0]
+
+    async def get_stability_batch(self, list_of_blocks, list_of_static_blocks=None):
+        """Returns the stability of each of the given lists of blocks as a list of booleans. The batch is split across workers."""
+        if len(list_of_blocks) == 0:
+            return []
+        if list_of_static_blocks is None:
+            list_of_static_blocks = [() for blocks in list_of_blocks]
+        chunk_size = math.ceil(len(list_of_blocks) / self.n_workers)
+        starts = range(0, len(list_of_blocks), chunk_size)
+        results = await asyncio.gather(
+            *[
+                self._request(
+                    list_of_blocks[i : i + chunk_size],
+                    list_of_static_blocks[i : i + chunk_size],
+                )
+                for i in starts
+            ]
+        )
+        return [stable for chunk_result in results for stable in chunk_result]
+
+    async def _request(self, list_of_blocks, list_of_static_blocks):
+        """Sends a request to the least busy worker and waits for its answer."""
+        if len(self._workers) < self.n_workers:
+            await self.start()
+        request_id = self._next_request_id
+        self._next_request_id = (self._next_request_id + 1) % 2**32
+        request = pack_stability_request(
+            request_id, list_of_blocks, list_of_static_blocks, self.y_height
+        )
+        worker = min(self._workers, key=lambda worker: len(worker.pending))
+        statuses = await worker.send(request_id, request)
+        if len(statuses) != len(list_of_blocks) or STATUS_ERROR in statuses:
+            raise ValueError(
+                f"Unexpected output from physics server: {statuses}\nInput was: {request}"
+            )
+        return [status == STATUS_STABLE for status in statuses]
+
+
+class _AsyncWorker:
+    """A single node process of an AsyncPhysicsServer and the requests that are waiting for its answers."""
+
+    def __init__(self, server):
+        self.server = server
+        self.process = None
+        self.reader = None
+        self.pending = {}  # request id -> (future, request)
+
+    async def launch(self):
+        """Launches the node process, switches it to the binary protocol and starts reading its responses."""
+        self.process = await self._launch_process()
+        self.reader = asyncio.ensure_future(self._read_responses())
+
+    async def _launch_process(self):
+        """Launches a node process and switches it to the binary protocol. The process is only handed out once it is configured, so that requests can't be interleaved with the configuration."""
+        process = await asyncio.create_subprocess_exec(
+            "node",
+            js_location,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await process.stdout.readline()  # the process prints "ready" when it's ready
+        message = {"config": self.server.config, "protocol": "binary"}
+        process.stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+        await process.stdin.drain()
+        answer = remove_ansi_codes((await process.stdout.readline()).decode("utf-8"))
+        if answer != "ok\n":
+            process.kill()
+            raise ValueError(
+                f"Unexpected output from physics server while configuring: {answer}"
+            )
+        return process
+
+    async def send(self, request_id, request):
+        """Sends the request and returns the status bytes of the answer once it arrives."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, request)
+        try:
+            self.process.stdin.write(request)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # the process has died—the reader restarts it and resends the pending requests
+            pass
+        return await future
+
+    async def _read_responses(self):
+        """Resolves the futures of the pending requests as responses arrive. Restarts the process if it dies."""
+        try:
+            while True:
+                header = await self.process.stdout.readexactly(6)
+                response_id, n_results = struct.unpack("<IH", header)
+                statuses = await self.process.stdout.readexactly(n_results)
+                future, _ = self.pending.pop(response_id)
+                if not future.done():
+                    future.set_result(statuses)
+        except asyncio.IncompleteReadError:
+            # the process has died: restart it and resend the outstanding requests
+            await self._restart()
+        except Exception as e:
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.pending = {}
+
+    async def _restart(self):
+        """Launches a new process and resends the outstanding requests to it."""
+        try:
+            process = await self._launch_process()
+            # requests sent while the process was launching went to the dead process. Swap in the new one and resend them without yielding to the event loop in between, so that every pending request is sent exactly once
+            self.process = process
+            for _, request in self.pending.values():
+                process.stdin.write(request)
+            self.reader = asyncio.ensure_future(self._read_responses())
+            await process.stdin.drain()
+        except Exception as e:
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.pending = {}
+
+    async def close(self):
+        """Stops reading responses and kills the process."""
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+# keep track of the pools to kill their workers on exit
+_pools = weakref.WeakSet()
 
 
 def remove_ansi_codes(text):
@@ -125,15 +705,32 @@ def remove_ansi_codes(text):
 
 def pickle_physics_server(server):
     """Pickle function for physics server. A new process is started when unpickled."""
-    return (Physics_Server, (server.y_height,))
+    return (
+        Physics_Server,
+        (server.y_height,),
+        {p: getattr(server, p) for p in Physics_Server.SIMULATION_PARAMETERS},
+    )
+
+
+def pickle_physics_server_pool(pool):
+    """Pickle function for physics server pools. New worker processes are started when unpickled."""
+    return (
+        PhysicsServerPool,
+        (pool.n_workers, pool.y_height),
+        {p: getattr(pool, p) for p in Physics_Server.SIMULATION_PARAMETERS},
+    )
 
 
 # register custom pickle function for the server
 copyreg.pickle(Physics_Server, pickle_physics_server)
+copyreg.pickle(PhysicsServerPool, pickle_physics_server_pool)
 
 
 @atexit.register
 def killallprocesses():
     """Kills all the processes that are still running once we close the file (ie. are done with everything)."""
     global process
-    process.kill()
+    if process is not None:
+        process.kill()
+    for pool in list(_pools):
+        pool.kill_server()
@@ -0,0 +1,181 @@
+"""Persistent cache of stability results that can be shared between processes.
+
+Configurations are always simulated at the same horizontal position and with their blocks in the same order (see `blockworld.canonical_blocks`), so stability is a pure function of the key of the configuration and we store the result of every physics simulation in a sqlite database on disk. All processes that open the same file (for example the worker processes of `experiment_runner.run_experiment`) share their results.
+
+The `StabilityMemo` below keeps the results of this process in memory.
+
+Usage:
+    cache = StabilityCache()
+    world = Blockworld(silhouette=silhouette, stability_cache=cache)
+"""
+
+import os
+import sqlite3
+
+from scoping_simulations.utils.directories import PROJ_DIR
+
+DEFAULT_CACHE_PATH = PROJ_DIR / "stability_cache.sqlite"
+
+
+class StabilityCache:
+    """Stability results keyed by a bytes key describing the configuration (see `Blockworld.State.stability_cache_key`), stored in a sqlite file.
+
+    The cache holds at most `max_entries` results. Once that is exceeded, the oldest entries are evicted. Hits and misses are counted per process, see `stats()`.
+
+    The cache can be pickled (and deepcopied along with a world): the connection to the database is reopened lazily in every process.
+    """
+
+    EVICTION_INTERVAL = 1000  # check the size of the cache every n insertions
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1000000, timeout=60):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.timeout = timeout  # seconds to wait for a lock held by another process
+        self.hits = 0
+        self.misses = 0
+        self._insertions = 0
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the connection can't be shared across processes
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def _get_connection(self):
+        """Returns the connection to the database for the current process, opening it if necessary."""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            self._pid = os.getpid()
+            # write ahead logging allows readers and a writer at the same time
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS stability (key BLOB PRIMARY KEY, stable INTEGER NOT NULL)"
+            )
+        return self._connection
+
+    def get(self, key):
+        """Returns the cached stability for the key or None if it isn't in the cache."""
+        row = (
+            self._get_connection()
+            .execute("SELECT stable FROM stability WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bool(row[0])
+
+    def put(self, key, stable):
+        """Stores the stability for the key."""
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO stability (key, stable) VALUES (?, ?)",
+            (key, int(stable)),
+        )
+        self._insertions += 1
+        if self._insertions % self.EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """Deletes the oldest entries until the cache holds at most `max_entries` results."""
+        connection = self._get_connection()
+        size = connection.execute("SELECT COUNT(*) FROM stability").fetchone()[0]
+        if size > self.max_entries:
+            connection.execute(
+                "DELETE FROM stability WHERE rowid IN (SELECT rowid FROM stability ORDER BY rowid LIMIT ?)",
+                (size - self.max_entries,),
+            )
+
+    def clear(self):
+        """Deletes all entries and resets the counters."""
+        self._get_connection().execute("DELETE FROM stability")
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return (
+            self._get_connection()
+            .execute("SELECT COUNT(*) FROM stability")
+            .fetchone()[0]
+        )
+
+    def stats(self):
+        """Returns a dictionary of hits and misses in this process and the number of entries in the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self),
+        }
+
+
+class StabilityMemo:
+    """In-memory stability results of this process, keyed by the translation invariant key of a configuration (see `blockworld.canonical_blocks_key`). Used by every `Blockworld.State`, no matter which world it belongs to, so subgoal worlds and copies of a world share their results.
+
+    `hits` counts the lookups that were answered from the memo. `translated_hits` counts the hits for a configuration at a different horizontal offset than where it was first seen, ie. the physics calls that only the translation invariance saves. Configurations are simulated shifted to x=0 and with their blocks in a fixed order (see `blockworld.canonical_blocks`), so the stored result depends on neither the offset nor the order of placement. Once the memo holds `max_entries` results, it is cleared.
+    """
+
+    def __init__(self, max_entries=1000000):
+        self.max_entries = max_entries
+        # key: (stable, horizontal offset of the simulated configuration)
+        self._results = {}
+        self.reset_counters()
+
+    def get(self, key, offset=0):
+        """Returns the stability for the key or None if it isn't in the memo. `offset` is the horizontal offset of the configuration we're looking up."""
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        stable, stored_offset = result
+        self.hits += 1
+        if stored_offset != offset:
+            self.translated_hits += 1
+        return stable
+
+    def put(self, key, stable, offset=0):
+        """Stores the stability for the key."""
+        if len(self._results) >= self.max_entries:
+            self._results.clear()
+        self._results[key] = (stable, offset)
+
+    def clear(self):
+        """Deletes all entries and resets the counters."""
+        self._results.clear()
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Resets the hit and miss counters."""
+        self.hits = 0
+        self.translated_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def stats(self):
+        """Returns a dictionary of hits, translated hits and misses in this process and the number of entries in the memo."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "translated_hits": self.translated_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self),
+        }
+
+
+# shared by all worlds in this process
+stability_memo = StabilityMemo()
+# probabilities of stability under noise (see `Blockworld.State.stability_probability`)
+stability_probability_memo = StabilityMemo()
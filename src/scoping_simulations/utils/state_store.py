@@ -0,0 +1,83 @@
+"""Transposition table of the states of a world.
+
+Different orders of placing the same blocks lead to the same configuration. Without a store, every transition creates a new `Blockworld.State` that computes its blockmap, stability, scores and actions again. With a `StateStore`, transitions of the world return the state that is already known for the configuration, with all of its cached values.
+
+Usage:
+    world = Blockworld(silhouette=silhouette, state_store=StateStore())
+    ...
+    world.state_store.stats()
+"""
+
+from collections import OrderedDict
+
+
+class StateStore:
+    """States of one world keyed by their order invariant hash (see `Blockworld.State.zobrist_hash`).
+
+    The store holds at most `max_entries` states. Once that is exceeded, the least recently used state is evicted. Since states cache values that depend on the silhouette (like the F1 score), the store is emptied whenever it is used with a different silhouette than the one its states were stored with. Hits, misses and evictions are counted, see `stats()`.
+
+    Every world needs its own store: the stored states belong to the world that created them. `Blockworld.fork` gives the fork a new, empty store.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._silhouette = None  # the silhouette the states were stored with
+        self.reset_counters()
+
+    def get(self, key, codes=None, silhouette=None):
+        """Returns the stored state for the key or None if there is none. Pass the packed blocks of the configuration (see `blockworld.pack_block`) as `codes` to make sure that the stored state consists of the same blocks and not only has the same hash."""
+        self._check_silhouette(silhouette)
+        state = self._states.get(key)
+        if (
+            state is not None
+            and codes is not None
+            and sorted(codes) != sorted(state.block_codes())
+        ):
+            state = None  # hash collision
+        if state is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._states.move_to_end(key)
+        return state
+
+    def put(self, key, state, silhouette=None):
+        """Stores the state under the key."""
+        self._check_silhouette(silhouette)
+        self._states[key] = state
+        self._states.move_to_end(key)
+        if len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    def _check_silhouette(self, silhouette):
+        """Empties the store if the silhouette changed since the states were stored."""
+        if silhouette is not self._silhouette:
+            self._states.clear()
+            self._silhouette = silhouette
+
+    def clear(self):
+        """Deletes all states and resets the counters."""
+        self._states.clear()
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Resets the hit, miss and eviction counters."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self):
+        """Returns a dictionary of hits, misses and evictions and the number of states in the store."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self),
+        }
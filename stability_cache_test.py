@@ -0,0 +1,142 @@
+import copy
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from scoping_simulations.utils import stability_cache
+from scoping_simulations.utils.blockworld import Blockworld
+from stability_test import random_towers, shift
+
+
+class TestStabilityCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "stability_cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_get(self):
+        cache = stability_cache.StabilityCache(self.path)
+        self.assertIsNone(cache.get(b"a"))
+        cache.put(b"a", True)
+        cache.put(b"b", False)
+        self.assertEqual(cache.get(b"a"), True)
+        self.assertEqual(cache.get(b"b"), False)
+        cache.put(b"a", False)
+        self.assertEqual(cache.get(b"a"), False)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(
+            cache.stats(), {"hits": 3, "misses": 1, "hit_rate": 0.75, "entries": 2}
+        )
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_eviction(self):
+        # the oldest entries are evicted first
+        cache = stability_cache.StabilityCache(self.path, max_entries=10)
+        cache.EVICTION_INTERVAL = 5
+        for i in range(25):
+            cache.put(str(i).encode(), True)
+        self.assertEqual(len(cache), 10)
+        self.assertIsNone(cache.get(b"0"))
+        self.assertIsNone(cache.get(b"14"))
+        self.assertEqual(cache.get(b"15"), True)
+        self.assertEqual(cache.get(b"24"), True)
+
+    def test_shared(self):
+        # copies (eg. in other processes) open their own connection to the same file
+        cache = stability_cache.StabilityCache(self.path)
+        cache.put(b"a", True)
+        for other_cache in [pickle.loads(pickle.dumps(cache)), copy.deepcopy(cache)]:
+            self.assertIsNone(other_cache.__getstate__()["_connection"])
+            self.assertEqual(other_cache.get(b"a"), True)
+            other_cache.put(b"b", False)
+            self.assertEqual(cache.get(b"b"), False)
+
+    def test_world(self):
+        # results of physics simulations are stored in the cache and read back by other worlds
+        cache = stability_cache.StabilityCache(self.path)
+
+        def make_world():
+            return Blockworld(
+                silhouette=np.ones((8, 8)),
+                physics_provider="box2d",
+                stability_prefilter=False,
+                stability_memo=False,
+                stability_cache=cache,
+            )
+
+        towers = random_towers(10, 4)
+        stabilities = [
+            Blockworld.State(make_world(), blocks).stability() for blocks in towers
+        ]
+        # every configuration was simulated once
+        stats = cache.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], len(towers))
+        self.assertEqual(stats["entries"], stats["misses"])
+        self.assertEqual(
+            [Blockworld.State(make_world(), blocks).stability() for blocks in towers],
+            stabilities,
+        )
+        self.assertEqual(cache.stats()["hits"], stats["hits"] + len(towers))
+        self.assertEqual(cache.stats()["misses"], stats["misses"])
+        self.assertEqual(len(cache), stats["entries"])
+
+
+class TestStabilityMemo(unittest.TestCase):
+    def test_put_get(self):
+        memo = stability_cache.StabilityMemo()
+        self.assertIsNone(memo.get(b"a"))
+        memo.put(b"a", True, offset=2)
+        self.assertEqual(memo.get(b"a", offset=2), True)
+        self.assertEqual(memo.get(b"a", offset=5), True)
+        self.assertEqual(
+            memo.stats(),
+            {
+                "hits": 2,
+                "translated_hits": 1,
+                "misses": 1,
+                "hit_rate": 2 / 3,
+                "entries": 1,
+            },
+        )
+        memo.clear()
+        self.assertEqual(len(memo), 0)
+        self.assertEqual(memo.stats()["hits"], 0)
+
+    def test_max_entries(self):
+        # a full memo is cleared
+        memo = stability_cache.StabilityMemo(max_entries=3)
+        for key in [b"a", b"b", b"c", b"d"]:
+            memo.put(key, True)
+        self.assertEqual(len(memo), 1)
+        self.assertIsNone(memo.get(b"a"))
+        self.assertEqual(memo.get(b"d"), True)
+
+    def test_world(self):
+        # towers that only differ in their horizontal offset are simulated once
+        stability_cache.stability_memo.clear()
+        world = Blockworld(
+            dimension=(8, 16),
+            silhouette=np.ones((8, 16)),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            component_stability=False,
+        )
+        blocks = random_towers(1, 4)[-1]
+        stable = Blockworld.State(world, blocks).stability()
+        for dx in range(1, 5):
+            self.assertEqual(
+                Blockworld.State(world, shift(blocks, dx)).stability(), stable
+            )
+        self.assertEqual(stability_cache.stability_memo.stats()["translated_hits"], 4)
+        self.assertEqual(stability_cache.stability_memo.stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
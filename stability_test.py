@@ -0,0 +1,271 @@
+import copy
+import random
+import unittest
+
+import numpy as np
+
+from scoping_simulations.utils import matter_server, stability_cache
+from scoping_simulations.utils.blockworld import (
+    BaseBlock,
+    Block,
+    Blockworld,
+    analytic_stability,
+)
+
+
+def full_simulation_world():
+    """Returns a world that simulates every configuration in full with Box2D, without any of the shortcuts."""
+    return Blockworld(
+        silhouette=np.ones((8, 8)),
+        physics_provider="box2d",
+        stability_prefilter=False,
+        stability_memo=False,
+        component_stability=False,
+    )
+
+
+def random_towers(n_towers, n_blocks, width=8, seed=0):
+    """Returns the lists of blocks of `n_towers` towers of up to `n_blocks` random blocks in a world of the given width, with every tower along the way."""
+    random.seed(seed)
+    world = Blockworld(
+        dimension=(8, width),
+        silhouette=np.ones((8, width)),
+        physics=False,
+        legal_action_space=False,
+    )
+    towers = []
+    for i in range(n_towers):
+        world.reset()
+        for j in range(n_blocks):
+            actions = world.current_state.possible_actions()
+            if actions == []:
+                break
+            world.apply_action(random.choice(actions))
+            towers.append(world.current_state.blocks)
+    return towers
+
+
+def shift(blocks, dx):
+    """Returns copies of the blocks moved dx cells to the right."""
+    shifted_blocks = [copy.copy(b) for b in blocks]
+    for b in shifted_blocks:
+        b.x += dx
+    return shifted_blocks
+
+
+class TestStability(unittest.TestCase):
+    def setUp(self):
+        stability_cache.stability_memo.clear()
+        stability_cache.stability_probability_memo.clear()
+
+    def test_incremental_box2d(self):
+        # box2d has no static bodies, so incremental stability has to simulate the full tower
+        world = Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics_provider="box2d",
+            incremental_stability=True,
+            stability_prefilter=False,
+            stability_memo=False,
+            component_stability=False,
+            legal_action_space=False,
+        )
+        reference = full_simulation_world()
+        random.seed(0)
+        for i in range(20):
+            world.reset()
+            for j in range(6):
+                state = world.current_state
+                if not state.stability():
+                    break
+                children = [state.transition(a) for a in state.possible_actions()]
+                self.assertEqual(
+                    world.stability_batch(children),
+                    [
+                        Blockworld.State(reference, child.blocks).stability()
+                        for child in children
+                    ],
+                )
+                world.apply_action(random.choice(state.possible_actions()))
+
+    def test_memo_translation_invariant(self):
+        # the stability of a tower must not depend on the offset at which the memo first saw it
+        world = Blockworld(
+            dimension=(8, 16),
+            silhouette=np.ones((8, 16)),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            component_stability=False,
+        )
+        reference = full_simulation_world()
+        random.seed(0)
+        for blocks in random_towers(100, 6, width=6):
+            offsets = list(range(10))
+            random.shuffle(offsets)
+            stabilities = [
+                Blockworld.State(world, shift(blocks, dx)).stability() for dx in offsets
+            ]
+            self.assertEqual(
+                stabilities,
+                [Blockworld.State(reference, blocks).stability()] * len(offsets),
+            )
+
+    def test_memo_order_invariant(self):
+        # nor on the order in which the blocks of the tower were placed
+        world = Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            component_stability=False,
+        )
+        reference = full_simulation_world()
+        random.seed(0)
+        for blocks in random_towers(100, 6):
+            stabilities = []
+            for i in range(5):
+                shuffled_blocks = list(blocks)
+                random.shuffle(shuffled_blocks)
+                stabilities.append(Blockworld.State(world, shuffled_blocks).stability())
+            self.assertEqual(
+                stabilities, [Blockworld.State(reference, blocks).stability()] * 5
+            )
+
+    def test_component_stability(self):
+        # splitting towers into parts has to agree with simulating them as a whole
+        world = Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            component_stability=True,
+        )
+        reference = full_simulation_world()
+        towers = random_towers(300, 6)
+        self.assertTrue(
+            any(len(Blockworld.State(world, b).components()) > 1 for b in towers)
+        )
+        # one at a time
+        self.assertEqual(
+            [Blockworld.State(world, blocks).stability() for blocks in towers],
+            [Blockworld.State(reference, blocks).stability() for blocks in towers],
+        )
+        # and batched
+        stability_cache.stability_memo.clear()
+        self.assertEqual(
+            world.stability_batch(
+                [Blockworld.State(world, blocks) for blocks in towers]
+            ),
+            [Blockworld.State(reference, blocks).stability() for blocks in towers],
+        )
+
+    def test_analytic_stability(self):
+        # the pre-filter may only decide what the physics engine agrees with
+        reference = full_simulation_world()
+        decided = 0
+        for blocks in random_towers(300, 6):
+            state = Blockworld.State(reference, blocks)
+            analytic_result = analytic_stability(state.blockmap, state.blocks)
+            if analytic_result != "uncertain":
+                decided += 1
+                self.assertEqual(analytic_result == "stable", state.stability())
+        self.assertGreater(decided, 0)
+
+    def test_analytic_stability_corner(self):
+        # a block that only touches another block at a corner can come to rest on it
+        blocks = [
+            Block(BaseBlock(2, 4), 0, 7),
+            Block(BaseBlock(2, 4), 5, 7),
+            Block(BaseBlock(4, 2), 1, 3),
+        ]
+        state = Blockworld.State(full_simulation_world(), blocks)
+        self.assertTrue(state.stability())
+        self.assertEqual(analytic_stability(state.blockmap, state.blocks), "uncertain")
+
+    def test_stability_key_config(self):
+        # results of differently configured simulations must not share keys
+        blocks = random_towers(1, 3)[-1]
+
+        def key(physics_provider):
+            world = Blockworld(
+                silhouette=np.ones((8, 8)), physics_provider=physics_provider
+            )
+            return Blockworld.State(world, blocks).stability_cache_key()
+
+        self.assertEqual(
+            key(matter_server.Physics_Server()), key(matter_server.Physics_Server())
+        )
+        self.assertNotEqual(
+            key(matter_server.Physics_Server()),
+            key(matter_server.Physics_Server(early_exit=True)),
+        )
+        self.assertNotEqual(
+            key(matter_server.Physics_Server(early_exit=True)),
+            key(matter_server.Physics_Server(early_exit=True, min_frames=30)),
+        )
+        self.assertNotEqual(key("box2d"), key(matter_server.Physics_Server()))
+        world = Blockworld(silhouette=np.ones((8, 8)), physics_provider="box2d")
+        state = Blockworld.State(world, blocks)
+        box2d_key = state.stability_cache_key()
+        world.box2d_simulator.early_exit = False
+        self.assertNotEqual(state.stability_cache_key(), box2d_key)
+
+    def test_stability_probability(self):
+        world = Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics_provider="box2d",
+            stability_prefilter=False,
+            component_stability=False,
+        )
+        towers = random_towers(30, 5)
+        # without noise, every sample is the configuration itself
+        for blocks in towers:
+            state = Blockworld.State(world, blocks)
+            self.assertEqual(
+                state.stability_probability(n_samples=3, noise=0),
+                float(state.stability()),
+            )
+        # the noise is seeded by the configuration
+        probabilities = [
+            Blockworld.State(world, blocks).stability_probability(n_samples=10)
+            for blocks in towers
+        ]
+        stability_cache.stability_memo.clear()
+        stability_cache.stability_probability_memo.clear()
+        self.assertEqual(
+            [
+                Blockworld.State(world, shift(blocks, 1)).stability_probability(
+                    n_samples=10
+                )
+                for blocks in towers
+            ],
+            probabilities,
+        )
+
+    def test_support_cone(self):
+        # a bridge over two pillars next to a stack
+        blocks = [
+            Block(BaseBlock(1, 2), 0, 7),
+            Block(BaseBlock(1, 2), 3, 7),
+            Block(BaseBlock(1, 2), 6, 7),
+            Block(BaseBlock(1, 1), 6, 5),
+        ]
+        world = Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics_provider=matter_server.Physics_Server(),
+            incremental_stability=True,
+            legal_action_space=False,
+        )
+        parent = Blockworld.State(world, blocks)
+        parent._stable = True
+        state = world.transition((BaseBlock(4, 1), 0), parent, force=True)
+        self.assertEqual(state.support_cone(), {0, 1, 4})
+        self.assertEqual(state.support_cone(3), {2, 3})
+        # only the bridge and its pillars are simulated, the stack is static
+        cone_blocks, static_blocks = state._physics_request()
+        self.assertEqual(cone_blocks, [blocks[0], blocks[1], state.blocks[-1]])
+        self.assertEqual(static_blocks, blocks[2:])
+        # without a parent known to be stable, everything is simulated
+        parent._stable = None
+        self.assertEqual(state._physics_request(), (state.blocks, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
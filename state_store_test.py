@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from scoping_simulations.utils.blockworld import Blockworld
+from scoping_simulations.utils.state_store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+    def make_world(self, max_entries=100000):
+        return Blockworld(
+            silhouette=np.ones((8, 8)),
+            physics=False,
+            state_store=StateStore(max_entries),
+        )
+
+    def test_lru(self):
+        # the least recently used state is evicted first
+        world = self.make_world()
+        states = [
+            world.transition(action)
+            for action in world.current_state.possible_actions()[:4]
+        ]
+        store = StateStore(max_entries=3)
+        for state in states[:3]:
+            store.put(state.zobrist_hash(), state)
+        self.assertIs(store.get(states[0].zobrist_hash()), states[0])
+        store.put(states[3].zobrist_hash(), states[3])
+        self.assertEqual(len(store), 3)
+        self.assertIsNone(store.get(states[1].zobrist_hash()))
+        for state in [states[0], states[2], states[3]]:
+            self.assertIs(store.get(state.zobrist_hash()), state)
+        self.assertEqual(
+            store.stats(),
+            {
+                "hits": 4,
+                "misses": 1,
+                "evictions": 1,
+                "hit_rate": 0.8,
+                "entries": 3,
+            },
+        )
+
+    def test_codes(self):
+        # states with the same hash, but other blocks are not returned
+        world = self.make_world()
+        state, other_state = [
+            world.transition(action)
+            for action in world.current_state.possible_actions()[:2]
+        ]
+        store = StateStore()
+        store.put(1, state)
+        self.assertIsNone(store.get(1, other_state.block_codes()))
+        self.assertIs(store.get(1, state.block_codes()), state)
+
+    def test_silhouette(self):
+        # the store is emptied when it is used with another silhouette
+        world = self.make_world()
+        state = world.transition(world.current_state.possible_actions()[0])
+        store = world.state_store
+        self.assertIs(store.get(state.zobrist_hash(), None, world.silhouette), state)
+        world.set_silhouette(np.ones((8, 8)))
+        self.assertIsNone(store.get(state.zobrist_hash(), None, world.silhouette))
+        self.assertEqual(len(store), 0)
+
+    def test_transpositions(self):
+        # placing the same blocks in another order leads to the same state object
+        world = self.make_world()
+        a, b = (world.block_library[0], 0), (world.block_library[1], 4)
+        state = world.transition(b, world.transition(a))
+        self.assertIs(world.transition(a, world.transition(b)), state)
+        self.assertEqual(world.state_store.stats()["hits"], 1)
+        # with its cached values
+        state._stable = True
+        self.assertTrue(world.transition(a, world.transition(b))._stable)
+
+    def test_fork(self):
+        # forks get their own, empty store
+        world = self.make_world(max_entries=10)
+        world.transition(world.current_state.possible_actions()[0])
+        fork = world.fork()
+        self.assertIsNot(fork.state_store, world.state_store)
+        self.assertEqual(len(fork.state_store), 0)
+        self.assertEqual(fork.state_store.max_entries, 10)
+        self.assertIs(
+            fork.transition(fork.current_state.possible_actions()[0]).world, fork
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()